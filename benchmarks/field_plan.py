@@ -0,0 +1,127 @@
+"""
+Times the per-row cost of ``TablespaceMigration.get_form_data`` over the rows
+of a generated staging tablespace:
+
+* ``field map``: the field map examined for every row, as before field maps
+  were compiled (``process_field`` per key, fields read by name);
+* ``plan by name``: the compiled ``TablespaceFieldPlan``, unbound;
+* ``plan by index``: the plan bound to the column indices of the rows.
+
+    python benchmarks/field_plan.py [rows] [repeat]
+
+Each figure is the best of ``repeat`` passes over the rows. ``db_migration``
+and Django must be importable.
+
+"""
+from django.conf import settings
+
+import tempfile
+import logging
+import shutil
+import timeit
+import sys
+import os
+
+staging_dir = tempfile.mkdtemp()
+settings.configure(
+    DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+    INSTALLED_APPS=('django.contrib.contenttypes',),
+    DB_MIGRATION_BACKENDS={'default': ('filemaker', os.path.join(staging_dir,'staging'))},
+    )
+
+from django.db import models
+
+from db_migration import TablespaceMigration, CleanConversion, BooleanConversion
+from db_migration.tablespace import MigrationDatabase, get_row_columns
+
+
+FIELDS = [('id','NUMBER'),('name','TEXT'),('email','TEXT'),('city','TEXT'),
+          ('notes','TEXT'),('active','TEXT')]
+
+class Contact(models.Model):
+    legacy_id = models.IntegerField()
+    name = models.CharField(max_length=100)
+    email = models.CharField(max_length=100)
+    city = models.CharField(max_length=100)
+    active = models.BooleanField()
+
+    class Meta:
+        app_label = 'benchmarks'
+
+class NameConversion(CleanConversion):
+    field_name = 'name'
+    strip_chars = ' '
+
+class ActiveConversion(BooleanConversion):
+    field_name = 'active'
+    truth_mapping = {'Yes': True, 'No': False}
+
+class ContactMigration(TablespaceMigration):
+    class Meta:
+        tablespace = 'contacts'
+        model = Contact
+        presave_field_map = {
+            'legacy_id': 'id',
+            'name': NameConversion,
+            'email': 'email',
+            'city': 'city',
+            'active': ActiveConversion,
+            'notes': None,
+            }
+
+def get_form_data_by_map(migration, raw_object):
+    """
+    The pre-save field conversion of ``get_form_data`` before field maps were
+    compiled into plans.
+
+    """
+    form_data = migration.defaults.copy()
+    for key,value in migration.presave_field_map.iteritems():
+        logging.info("presave_field: %s:%s" % (key,value))
+        if value is None:
+            logging.info("key=%s has been explicitly removed in tablespace=%s. Skipping." % \
+                             (key,migration.tablespace))
+            continue
+        try:
+            convertor,conversion_value = migration.process_field(key,value,raw_object)
+            form_data[key] = convertor.convert(conversion_value,raw_object,form_data)
+        except IndexError:
+            pass
+    return form_data
+
+def load_rows(migration, rows):
+    db = migration.db
+    db.create_tablespace('contacts',FIELDS)
+    db.bulk_load_objects('contacts',FIELDS,
+        ((i,u' Name %d ' % i,u'contact%d@example.com' % i,u'City %d' % (i % 100),
+          u'Notes on contact %d' % i,(u'Yes',u'No')[i % 2]) for i in xrange(rows)))
+    return db.get_objects('contacts',{},{})
+
+def best_of(repeat, rows, func):
+    def run():
+        for row in rows:
+            func(row)
+    return min(timeit.repeat(run,repeat=repeat,number=1)) / len(rows)
+
+def main(rows=10000, repeat=5):
+    logging.getLogger().setLevel(logging.ERROR)
+    try:
+        migration = ContactMigration()
+        rows = load_rows(migration,rows)
+        columns = get_row_columns(rows[0])
+
+        results = [
+            ('field map', best_of(repeat,rows,lambda row: get_form_data_by_map(migration,row))),
+            ('plan by name', best_of(repeat,rows,lambda row: migration.get_form_data(row))),
+            ('plan by index', best_of(repeat,rows,lambda row: migration.get_form_data(row,columns=columns))),
+            ]
+        print "get_form_data over %d rows, best of %d:" % (len(rows),repeat)
+        baseline = results[0][1]
+        for name,seconds in results:
+            print "  %-14s %6.1f us/row (%.1fx)" % (name,seconds * 1000000,baseline / seconds)
+    finally:
+        MigrationDatabase.close_databases()
+        shutil.rmtree(staging_dir)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
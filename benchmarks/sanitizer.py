@@ -0,0 +1,110 @@
+"""
+Compares the sanitization of a large generated FileMaker Pro XML export by
+``InputSanitizer`` (a single ``str.translate`` pass over each chunk read)
+with the former double pass: a ``str.replace`` loop over ``REMOVE_CHARS`` on
+every chunk read and again on every text callback of the content handler.
+
+    python benchmarks/sanitizer.py [rows] [repeat]
+
+Both the sanitization of the raw chunks alone and a complete
+``Backend.iter_data`` run are timed (best of ``repeat``). ``db_migration``
+and Django must be importable.
+
+"""
+from django.conf import settings
+settings.configure()
+
+from db_migration.backends.filemaker import \
+    Backend, FileMakerProContentHandler, REMOVE_CHARS, CHUNK_SIZE
+
+import tempfile
+import timeit
+import sys
+import os
+
+
+HEADER = u'''<?xml version="1.0" encoding="UTF-8" ?>
+<FMPXMLRESULT xmlns="http://www.filemaker.com/fmpxmlresult"><ERRORCODE>0</ERRORCODE><PRODUCT BUILD="" NAME="FileMaker Pro" VERSION="6"/><DATABASE DATEFORMAT="M/d/yyyy" LAYOUT="" NAME="contacts.fp5" RECORDS="%(rows)d" TIMEFORMAT="h:mm:ss a"/><METADATA><FIELD EMPTYOK="YES" MAXREPEAT="1" NAME="id" TYPE="NUMBER"/><FIELD EMPTYOK="YES" MAXREPEAT="1" NAME="name" TYPE="TEXT"/><FIELD EMPTYOK="YES" MAXREPEAT="1" NAME="notes" TYPE="TEXT"/><FIELD EMPTYOK="YES" MAXREPEAT="1" NAME="born" TYPE="DATE"/></METADATA><RESULTSET FOUND="%(rows)d">
+'''
+ROW = u'<ROW MODID="1" RECORDID="%(id)d"><COL><DATA>%(id)d</DATA></COL><COL><DATA>Name %(id)d &amp; co</DATA></COL><COL><DATA>Line one\x0bline two\x0c of the notes on r\xe9cord %(id)d</DATA></COL><COL><DATA>1/%(day)d/1970</DATA></COL></ROW>\n'
+FOOTER = u'</RESULTSET></FMPXMLRESULT>\n'
+
+
+class ReplaceLoopSanitizer(object):
+    """
+    The former sanitization of the chunks read: a ``str.replace`` pass per
+    character.
+
+    """
+    def sanitize(self, chunk):
+        for c,r in REMOVE_CHARS:
+            chunk = chunk.replace( c,r )
+        return chunk
+
+class ReplaceLoopContentHandler(FileMakerProContentHandler):
+    """
+    The former content handler, which repeated the replacements on every
+    text callback.
+
+    """
+    def characters(self, content):
+        for c,r in REMOVE_CHARS:
+            content = content.replace( c,r )
+        FileMakerProContentHandler.characters(self,content)
+
+def write_export(filename, rows):
+    fp = open(filename,'wb')
+    try:
+        fp.write( (HEADER % {'rows':rows}).encode('utf-8') )
+        for i in xrange(rows):
+            fp.write( (ROW % {'id':i, 'day':i % 28 + 1}).encode('utf-8') )
+        fp.write( FOOTER.encode('utf-8') )
+    finally:
+        fp.close()
+
+def sanitize_chunks(filename, sanitizer):
+    fp = open(filename,'rU')
+    try:
+        while True:
+            chunk = fp.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            sanitizer.sanitize( chunk )
+    finally:
+        fp.close()
+
+def iter_export(filename, **backend_options):
+    # the backend reports its progress on stdout
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull,'w')
+    try:
+        backend = Backend(0,**backend_options)
+        for row in backend.iter_data(datafile=filename):
+            pass
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+def best_of(repeat, func, *args, **kwargs):
+    return min(timeit.repeat(lambda: func(*args,**kwargs),repeat=repeat,number=1))
+
+def main(rows=200000, repeat=3):
+    filename = tempfile.mktemp(suffix='.xml')
+    write_export(filename,rows)
+    try:
+        size = os.path.getsize(filename) / (1024.0 * 1024.0)
+        print "Export of %d rows (%.1f MB), best of %d:" % (rows,size,repeat)
+
+        old = best_of(repeat,sanitize_chunks,filename,ReplaceLoopSanitizer())
+        new = best_of(repeat,sanitize_chunks,filename,Backend(0).sanitizer)
+        print "  chunk sanitization: replace loop %.3fs, InputSanitizer %.3fs (%.1fx)" % (old,new,old / new)
+
+        old = best_of(repeat,iter_export,filename,
+                      sanitizer=ReplaceLoopSanitizer(),content_handler_cls=ReplaceLoopContentHandler)
+        new = best_of(repeat,iter_export,filename)
+        print "  iter_data:          double pass  %.3fs, InputSanitizer %.3fs (%.1fx)" % (old,new,old / new)
+    finally:
+        os.remove(filename)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -6,7 +6,7 @@ from db_migration.tablespace import ( \
     MigrationDatabaseError, MigrationDatabase)
 from db_migration.migration import ( \
     TablespaceMigrationError, TablespaceMigrationRegistry,
-    TablespaceMigration)
+    TablespaceMigrationContext, TablespaceFieldPlan, TablespaceMigration)
 from db_migration.conversion import ( \
     TablespaceValueConversionError, TablespaceValueConversion,
     SimpleConversion, ConcatinationConversion,
@@ -17,9 +17,14 @@ from db_migration.relation import ( \
     TablespaceRelationBindingError, TablespaceRelationBinding,
     ForeignKeyBinding, ManyToManyBinding,
     RelationBinding, 
-    GenericForeignKeyBinding, GenericRelationBinding,)
+    GenericForeignKeyBinding, GenericRelationBinding,
+    native_key_type,)
+from db_migration.purge import ( \
+    TablespacePurgeError, TablespacePurge)
 from db_migration.plan import ( \
     TablespaceMigrationPlan)
+from db_migration.advisor import ( \
+    TablespaceIndexAdvisor)
 
 
 def autodiscover():
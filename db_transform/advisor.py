@@ -0,0 +1,142 @@
+from django.conf import settings
+
+from db_migration.migration import TablespaceMigrationError, TablespaceMigrationRegistry
+from db_migration.tablespace import MigrationDatabase
+
+import logging
+import sqlite3
+import re
+
+
+SCAN_DETAIL = re.compile(r'^SCAN (?:TABLE )?(\w+)')
+
+class TablespaceIndexAdvisor(object):
+    """
+    Works out which staging indexes the given migrations (all registered
+    migrations by default) rely upon -- the columns of their ``conditions``,
+    the join columns of their ``additional_tablespaces`` and the ``remote_key``
+    of the relation bindings they fetch through -- and creates those which are
+    missing.
+
+    """
+    def __init__(self, migrations=None):
+        if migrations is None:
+            migrations = TablespaceMigrationRegistry.registry.values()
+        self.migrations = migrations
+
+    def get_database(self, backend):
+        try:
+            backend_name,db_name = settings.DB_MIGRATION_BACKENDS[backend]
+        except (AttributeError,KeyError), e:
+            raise TablespaceMigrationError("%s"%e)
+        return MigrationDatabase.get_database(db_name)
+
+    def _add_relation_queries(self, migration_cls, tablespace, queries, visited):
+        meta = migration_cls._meta
+        for relation_map in (meta.presave_relation_map,meta.postsave_relation_map):
+            for key,relations in relation_map.iteritems():
+                if type(relations) != tuple and type(relations) != list:
+                    relations = [relations,]
+                for relation_cls in relations:
+                    related_cls = relation_cls._meta.migration
+                    if not related_cls:
+                        continue
+                    related_tablespace = related_cls._meta.tablespace or tablespace
+                    remote_key = relation_cls._meta.remote_key
+                    if relation_cls._meta.fetch and remote_key:
+                        queries.append( \
+                            ("%s.%s" % (migration_cls.__name__,key), related_cls._meta.backend,
+                             related_tablespace, {remote_key:None},
+                             dict(related_cls._meta.additional_tablespaces), False) )
+                    if (related_cls,related_tablespace) not in visited:
+                        visited.add( (related_cls,related_tablespace) )
+                        self._add_relation_queries(related_cls,related_tablespace,queries,visited)
+
+    def get_queries(self):
+        """
+        Returns a (description, backend, tablespace, lookup, additional_tablespaces,
+        driving) tuple for each kind of query the migrations run against their
+        staging databases: the selection of their source rows (``driving``) and
+        the lookups made by their relation bindings.
+
+        """
+        queries = []
+        for migration_cls in self.migrations:
+            meta = migration_cls._meta
+            # migrations without a tablespace are only run through relation bindings
+            if not meta.tablespace:
+                continue
+            queries.append( \
+                (migration_cls.__name__, meta.backend, meta.tablespace,
+                 dict(meta.conditions), dict(meta.additional_tablespaces), True) )
+            self._add_relation_queries(migration_cls,meta.tablespace,queries,set())
+        return queries
+
+    def get_required_indexes(self):
+        """
+        Returns a mapping of (backend, tablespace) to the set of columns which
+        should be indexed.
+
+        """
+        required = {}
+        for description,backend,tablespace,lookup,additional_tablespaces,driving in self.get_queries():
+            required.setdefault((backend,tablespace),set()).update( lookup.keys() )
+            for tablespace_name,col_mapping in additional_tablespaces.iteritems():
+                required.setdefault((backend,tablespace_name),set()).add( col_mapping[1] )
+        return required
+
+    def create_indexes(self, dry_run=False):
+        """
+        Creates the required indexes which do not exist yet (unless ``dry_run``)
+        and returns them as (tablespace, columns) pairs.
+
+        """
+        missing_indexes = []
+        for (backend,tablespace),columns in sorted(self.get_required_indexes().items()):
+            db = self.get_database(backend)
+            tablespace_columns = [column[0].lower() for column in db.get_columns(tablespace)]
+            if not tablespace_columns:
+                logging.warn("Tablespace %s has not been imported. Skipping." % (tablespace))
+                continue
+
+            indexed_columns = db.get_indexed_columns(tablespace)
+            missing = []
+            for column in sorted(columns):
+                if column.lower() not in tablespace_columns:
+                    logging.warn("Column %s is not defined by tablespace %s. Skipping." % (column,tablespace))
+                elif column.lower() not in indexed_columns:
+                    missing.append( column )
+            if not missing:
+                continue
+
+            if not dry_run:
+                db.create_indexes(tablespace,missing)
+                db.analyze(tablespace)
+            missing_indexes.append( (tablespace,missing) )
+        return missing_indexes
+
+    def explain(self):
+        """
+        Returns (description, tablespace, detail, full_scan) for each step of
+        the query plans of the migrations' queries. Full scans are flagged,
+        except for the scan of the source rows of a migration without
+        conditions.
+
+        """
+        report = []
+        for description,backend,tablespace,lookup,additional_tablespaces,driving in self.get_queries():
+            db = self.get_database(backend)
+            if not db.get_columns(tablespace):
+                continue
+            try:
+                details = db.explain(tablespace,lookup,additional_tablespaces)
+            except sqlite3.OperationalError, e:
+                report.append( (description,tablespace,u"Unable to explain query: %s" % (e),False) )
+                continue
+            for detail in details:
+                match = SCAN_DETAIL.match(detail)
+                full_scan = match is not None
+                if full_scan and driving and not lookup and match.group(1) == tablespace:
+                    full_scan = False
+                report.append( (description,tablespace,detail,full_scan) )
+        return report
@@ -1,17 +1,123 @@
 """ """
+import string
+
+
+def encode(value, encoding):
+    if isinstance(value,unicode):
+        return value.encode(encoding)
+    return value
+
+class InputSanitizer(object):
+    """
+    Removes or replaces characters in raw input in a single pass using a
+    translation table precomputed from ``replacements``, a sequence of
+    (character, replacement) pairs. Input may be given as a stream of chunks;
+    only replacements of more than one character (or, in byte input encoded
+    as ``encoding``, of non-ASCII characters) fall back to ``str.replace``
+    (and may therefore be missed across chunk boundaries).
+
+    """
+    def __init__(self, replacements, encoding='utf-8'):
+        # fallback replacements for unicode and for byte input
+        self.replacements = []
+        self.byte_replacements = []
+        self.unicode_table = {}
+
+        from_chars = []
+        to_chars = []
+        delete_chars = []
+        for c,r in replacements:
+            if len(c) != 1 or len(r) > 1:
+                self.replacements.append( (c,r) )
+                self.byte_replacements.append( (encode(c,encoding),encode(r,encoding)) )
+                continue
+            if r:
+                self.unicode_table[ord(c)] = unicode(r)
+            else:
+                self.unicode_table[ord(c)] = None
+
+            # non-ASCII characters take more than a byte once encoded
+            c,r = encode(c,encoding),encode(r,encoding)
+            if len(c) != 1 or len(r) > 1:
+                self.byte_replacements.append( (c,r) )
+            elif r:
+                from_chars.append( c )
+                to_chars.append( r )
+            else:
+                delete_chars.append( c )
+
+        self.table = string.maketrans( ''.join(from_chars),''.join(to_chars) )
+        self.delete_chars = ''.join(delete_chars)
+
+    def sanitize(self, chunk):
+        if isinstance(chunk,unicode):
+            chunk = chunk.translate( self.unicode_table )
+            replacements = self.replacements
+        else:
+            chunk = chunk.translate( self.table,self.delete_chars )
+            replacements = self.byte_replacements
+        for c,r in replacements:
+            chunk = chunk.replace( c,r )
+        return chunk
 
 class MigrationBackend(object):
     """ """
+    # (character, replacement) pairs applied to the raw input by ``sanitizer``
+    remove_chars = ()
+    # maps the source type of a field to the affinity of its staging column, if
+    # the backend is given ``typed_columns``
+    column_types = {}
+
     def __init__(self, max_records, **kwargs):
         self.max_records = max_records
         if not max_records and max_records != 0:
             self.max_records = 0
 
+        self.sanitizer = kwargs.pop('sanitizer',None)
+        if self.sanitizer is None:
+            self.sanitizer = InputSanitizer(self.remove_chars)
+
+        # typed affinities change the values read back from the staging
+        # database (leading zeros are lost, u'1.50' becomes 1.5 and long
+        # numbers lose precision as floats), so columns are TEXT unless asked for
+        if not kwargs.pop('typed_columns',False):
+            self.column_types = {}
+
     def parse(self, **kwargs):
         raise NotImplementedError
 
     def get_data(self, **kwargs):
         raise NotImplementedError
 
+    def iter_data(self, **kwargs):
+        """
+        Yields the parsed records one at a time. Backends able to read their
+        source incrementally should override this; by default the whole source
+        is parsed up front.
+
+        """
+        self.parse(**kwargs)
+        return iter(self.get_data())
+
     def get_fields(self, **kwargs):
         raise NotImplementedError
+
+class StreamingMigrationBackend(MigrationBackend):
+    """
+    Base class for backends which read their source incrementally: records are
+    produced one at a time by ``iter_data`` and ``parse``/``get_data`` are
+    implemented on top of it.
+
+    """
+    def __init__(self, max_records, **kwargs):
+        super(StreamingMigrationBackend,self).__init__(max_records,**kwargs)
+        self.data = []
+
+    def parse(self, **kwargs):
+        self.data = list(self.iter_data(**kwargs))
+
+    def get_data(self, **kwargs):
+        return self.data
+
+    def iter_data(self, **kwargs):
+        raise NotImplementedError
@@ -0,0 +1,76 @@
+from db_migration.backends import StreamingMigrationBackend
+
+import codecs
+import csv
+import os
+
+
+# delimiters assumed for datafiles by extension (otherwise a comma)
+DELIMITERS = {
+    '.tsv': '\t',
+    '.tab': '\t',
+}
+DEFAULT_ENCODING = 'utf-8'
+FIELD_TYPE = 'TEXT'
+
+class Backend(StreamingMigrationBackend):
+    """
+    Streams records from delimited (CSV/TSV) dumps. Fields are taken from the
+    header row and each record is produced as a tuple of unicode values in
+    field order; the file is never held in memory.
+
+    """
+    def __init__(self, max_records, **kwargs):
+        super(Backend,self).__init__(max_records,**kwargs)
+        self.encoding = kwargs.pop('encoding',None) or DEFAULT_ENCODING
+        self.delimiter = kwargs.pop('delimiter',None)
+        self.dialect = kwargs.pop('dialect','excel')
+        self.fields = []
+
+    def get_lines(self, fp):
+        """
+        Yields the sanitized lines of ``fp`` encoded as UTF-8, the only kind
+        of multi-byte input the ``csv`` module can cope with.
+
+        """
+        if codecs.lookup(self.encoding).name in ('utf-8','ascii'):
+            lines = fp
+        else:
+            lines = (line.encode('utf-8') for line in codecs.getreader(self.encoding)(fp))
+        for line in lines:
+            yield self.sanitizer.sanitize( line )
+
+    def iter_data(self, **kwargs):
+        datafile = kwargs.pop('datafile')
+        delimiter = self.delimiter
+        if not delimiter:
+            delimiter = DELIMITERS.get(os.path.splitext(datafile)[1].lower(),',')
+
+        fp = open(datafile, mode='rb')
+        try:
+            reader = csv.reader(self.get_lines(fp),dialect=self.dialect,delimiter=str(delimiter))
+            try:
+                header = reader.next()
+            except StopIteration:
+                return
+            self.fields = [(name.decode('utf-8').strip(),FIELD_TYPE) for name in header]
+            print "Reading delimited export with %d fields" % (len(self.fields))
+
+            width = len(self.fields)
+            rowctr = 0
+            for row in reader:
+                if not row:
+                    continue
+                if len(row) != width:
+                    row = (row + [None] * width)[:width]
+                yield tuple([value.decode('utf-8') if value is not None else None for value in row])
+
+                rowctr += 1
+                if self.max_records and rowctr >= self.max_records:
+                    print "Finished processing (%d records)" % (rowctr)
+                    break
+        finally:
+            fp.close()
+
+    def get_fields(self, **kwargs):
+        return self.fields
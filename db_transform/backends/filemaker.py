@@ -32,7 +32,7 @@ class FileMakerProContentHandler(xml.sax.handler.ContentHandler):
         self.content = ''
 
     def endDocument(self):
-        print "Loaded %d records." % len(self.data)
+        print "Loaded %d records." % (self.rowctr)
 
     def startElement(self, name, attrs):
         if name == "DATABASE":
@@ -52,8 +52,6 @@ class FileMakerProContentHandler(xml.sax.handler.ContentHandler):
             self.in_data = True
 
     def characters(self, content):
-        for c,r in REMOVE_CHARS:
-            content = content.replace(c,r)
         self.content = ''.join([ self.content,content ])
 
     def endElement(self, name):
@@ -75,19 +73,125 @@ class FileMakerProContentHandler(xml.sax.handler.ContentHandler):
                     (self.col_name, self.rowctr, self.row)
             self.content = ''
 
+class FileMakerProCompactContentHandler(object):
+    """
+    A compact variant of ``FileMakerProContentHandler`` which produces each row
+    as a tuple of values in field order (see ``fields``; ``None`` for columns
+    without data) instead of a dict, and collects text in a list buffer.
+
+    ``xml.sax.handler.ContentHandler`` is an old-style class and cannot be used
+    along with ``__slots__``, so its interface is implemented here directly.
+
+    """
+    __slots__ = ('fields','data','parse_limit','colctr','rowctr','row','buf','in_data')
+
+    def __init__(self, parse_limit=0):
+        self.fields = []
+        self.data = []
+
+        self.parse_limit = parse_limit
+        self.colctr = 0
+        self.rowctr = 0
+
+        self.row = None
+        self.buf = []
+        self.in_data = False
+
+    def setDocumentLocator(self, locator):
+        pass
+
+    def startDocument(self):
+        pass
+
+    def endDocument(self):
+        print "Loaded %d records." % (self.rowctr)
+
+    def startPrefixMapping(self, prefix, uri):
+        pass
+
+    def endPrefixMapping(self, prefix):
+        pass
+
+    def startElement(self, name, attrs):
+        if name == "DATA":
+            self.in_data = True
+        elif name == "ROW":
+            self.row = [None] * len(self.fields)
+            self.colctr = 0
+        elif name == "FIELD":
+            self.fields.append( (attrs.get('NAME'),attrs.get('TYPE')) )
+        elif name == "DATABASE":
+            print "Reading XML export of database '%s' containing %d records." % \
+                (attrs.get('NAME'),long(attrs.get('RECORDS')))
+        elif name == "RESULTSET":
+            print "Document contains %d records" % ( long(attrs.get('FOUND')) )
+
+    def characters(self, content):
+        if self.in_data:
+            self.buf.append( content )
+
+    def ignorableWhitespace(self, whitespace):
+        pass
+
+    def processingInstruction(self, target, data):
+        pass
+
+    def skippedEntity(self, name):
+        pass
+
+    def endElement(self, name):
+        if name == "DATA":
+            self.row[self.colctr] = u''.join(self.buf)
+            del self.buf[:]
+            self.in_data = False
+        elif name == "COL":
+            self.colctr += 1
+        elif name == "ROW":
+            self.data.append( tuple(self.row) )
+            self.rowctr += 1
+
+            if self.parse_limit and self.rowctr > self.parse_limit:
+                raise FileMakerProParseLimitExceededError( \
+                    "Finished processing (%d records)" % (self.rowctr)
+                    )
+
 REMOVE_CHARS = [
     ('\x0b',''),
     ('\x0c',''),
 ]
 
+# FileMaker exports dates and times in locale-dependent formats which SQLite
+# cannot compare, so only numbers are given a non-TEXT affinity. Only applied
+# with ``typed_columns``: NUMERIC drops leading zeros ('007' becomes 7) and
+# stores numbers too long for an integer as (lossy) floats, and conversions
+# expecting strings must be able to handle the numbers read back
+COLUMN_TYPES = {
+    'NUMBER': 'NUMERIC',
+    'TEXT': 'TEXT',
+    'DATE': 'TEXT',
+    'TIME': 'TEXT',
+    'TIMESTAMP': 'TEXT',
+    'CONTAINER': 'TEXT',
+}
+
+# number of bytes handed to the SAX parser at a time by ``Backend.iter_data``
+CHUNK_SIZE = 64 * 1024
+
 # class FileMakerProMigrationBackend(MigrationBackend):
 class Backend(MigrationBackend):
     """ """
+    remove_chars = REMOVE_CHARS
+    column_types = COLUMN_TYPES
+
     def __init__(self, max_records, **kwargs): 
         # super(FileMakerProMigrationBackend,self).__init__(max_records)
-        super(Backend,self).__init__(max_records)
-        content_handler_cls = kwargs.pop('content_handler_cls',FileMakerProContentHandler)
+        super(Backend,self).__init__(max_records,**kwargs)
+        default_content_handler_cls = FileMakerProContentHandler
+        if kwargs.pop('compact',False):
+            default_content_handler_cls = FileMakerProCompactContentHandler
+        content_handler_cls = kwargs.pop('content_handler_cls',default_content_handler_cls)
         self.content_handler = content_handler_cls(parse_limit=self.max_records)
+        self.chunk_size = kwargs.pop('chunk_size',CHUNK_SIZE)
 
     def parse(self, **kwargs):
         datafile = kwargs.pop('datafile')
@@ -95,14 +199,48 @@ class Backend(MigrationBackend):
         buf = fp.read()
         fp.close()
 
-        for c,r in REMOVE_CHARS:
-            buf = buf.replace( c,r )
+        buf = self.sanitizer.sanitize( buf )
 
         try:
             xml.sax.parseString( buf, self.content_handler )
         except FileMakerProParseLimitExceededError, e:
             print str(e)
 
+    def iter_data(self, **kwargs):
+        """
+        Incrementally feeds ``datafile`` to the SAX parser ``chunk_size`` bytes
+        at a time and yields rows as soon as they have been parsed. Rows are
+        not retained once yielded, so memory use does not grow with the size
+        of the export.
+
+        """
+        datafile = kwargs.pop('datafile')
+        parser = xml.sax.make_parser()
+        parser.setContentHandler( self.content_handler )
+        data = self.content_handler.data
+
+        fp = open(datafile, mode='rU')
+        try:
+            finished = False
+            while not finished:
+                buf = self.sanitizer.sanitize( fp.read(self.chunk_size) )
+
+                try:
+                    if buf:
+                        parser.feed( buf )
+                    else:
+                        parser.close()
+                        finished = True
+                except FileMakerProParseLimitExceededError, e:
+                    print str(e)
+                    finished = True
+
+                for row in data:
+                    yield row
+                del data[:]
+        finally:
+            fp.close()
+
     def get_data(self, **kwargs):
         return self.content_handler.data
 
@@ -2,14 +2,79 @@ from django.core.management.base import BaseCommand, CommandError
 from django.utils.importlib import import_module
 from django.conf import settings
 
-from db_migration.tablespace import MigrationDatabase
+from db_migration.tablespace import MigrationDatabase, DEFAULT_BATCH_SIZE
 
 from optparse import make_option
+import multiprocessing
+import itertools
 import datetime
+import time
+import os
 
 
 AVAILABLE_BACKENDS = getattr(settings,'DB_MIGRATION_BACKENDS', {})
 DEFAULT_DBNAME = 'migration_db'
+STAGING_DBNAME = '%(db_name)s.staging%(job)d'
+
+
+def load_datafile(backend_module_name, datafile, tablespace, db_name,
+                  limit=0, indexes=[], bulk=False, batch_size=DEFAULT_BATCH_SIZE, delta_key=None,
+                  backend_options={}):
+    """
+    Parses ``datafile`` with the given backend and (re)loads its records into
+    ``tablespace`` of the migration database ``db_name``, or applies them as an
+    incremental import keyed by ``delta_key``. ``backend_options`` are passed
+    on to the backend. Returns the parsed fields and the number of records
+    loaded.
+
+    """
+    started = time.time()
+    backend = import_module(backend_module_name).Backend(limit,**backend_options)
+    data = backend.iter_data(datafile=datafile)
+    # field definitions are only known once parsing reaches the first record
+    first = list(itertools.islice(data,1))
+    fields = backend.get_fields()
+    data = itertools.chain(first,data)
+
+    db = MigrationDatabase(db_name,bulk=bulk)
+    if delta_key:
+        print "Updating %s (keyed by %s)" % (tablespace,delta_key)
+        db.create_delta_tablespace(tablespace,fields,delta_key,backend.column_types)
+    else:
+        print "Dropping %s" % (tablespace)
+        db.delete_tablespace(tablespace)
+        print "(Re)loading %s" % (tablespace)
+        db.create_tablespace(tablespace,fields,backend.column_types)
+    if not bulk:
+        db.create_indexes(tablespace,indexes)
+    if delta_key:
+        cnt = db.delta_load_objects(tablespace,fields,data,delta_key,batch_size=batch_size)
+        print "Recorded import %d of %s" % (db.get_import_id(tablespace),tablespace)
+    else:
+        cnt = db.bulk_load_objects(tablespace,fields,data,batch_size=batch_size)
+    if bulk:
+        db.create_indexes(tablespace,indexes)
+        db.analyze(tablespace)
+
+    elapsed = time.time() - started
+    rate = 0.0
+    if elapsed:
+        rate = cnt / elapsed
+    print "Loaded %d records into %s (%.1f records/sec)" % (cnt,tablespace,rate)
+    return (fields,cnt)
+
+def load_staging_datafile(args):
+    """
+    Worker for parallel imports: loads a single datafile into a staging
+    database of its own, to be merged into the destination afterwards.
+
+    """
+    backend_module_name, datafile, tablespace, staging_db_name, limit, batch_size, backend_options = args
+    fields,cnt = load_datafile( \
+        backend_module_name, datafile, tablespace, staging_db_name,
+        limit=limit, bulk=True, batch_size=batch_size, backend_options=backend_options)
+    return (tablespace,staging_db_name,fields,cnt)
+
 
 class Command(BaseCommand):
     option_list = BaseCommand.option_list + (
@@ -25,6 +90,25 @@ class Command(BaseCommand):
                     help="Provide the backend with which to import source data"),
         make_option('--backend-db-name', action="store", dest="backend_db_name", default=DEFAULT_DBNAME,
                     help="Provide a filename to use for the purposes of importing source data"),
+        make_option('--bulk', action="store_true", dest="bulk", default=False,
+                    help="Relax durability while loading and build indexes "+
+                         "once the records have been loaded"),
+        make_option('--delta-key', action="store", dest="delta_key", default=None,
+                    help="Update the tablespace incrementally, identifying records "+
+                         "by the given field instead of reloading it"),
+        make_option('--compact', action="store_true", dest="compact", default=False,
+                    help="Have the backend produce positional (tuple) records"),
+        make_option('--encoding', action="store", dest="encoding", default=None,
+                    help="Provide the character encoding of the datafiles (delimited backend)"),
+        make_option('--delimiter', action="store", dest="delimiter", default=None,
+                    help="Provide the field delimiter of the datafiles (delimited backend)"),
+        make_option('--jobs', action="store", dest="jobs", default=1,
+                    help="Provide the number of datafiles to import in parallel"),
+        make_option('--batch-size', action="store", dest="batch_size", default=DEFAULT_BATCH_SIZE,
+                    help="Provide the number of records inserted per batch"),
+        make_option('--typed-columns', action="store_true", dest="typed_columns", default=False,
+                    help="Declare staging columns with the affinities of their source types "+
+                         "(numbers lose leading zeros and, if very long, precision)"),
         # 
         # TODO: create an 'all' tablespace setting?
         # 
@@ -37,13 +121,37 @@ class Command(BaseCommand):
     def handle(self, *datafiles, **options):
         tablespace = options.get('dest')
         limit = long(options.get('limit'))
+        batch_size = int(options.get('batch_size'))
         indexes = options.get('indexes')
+        bulk = options.get('bulk')
+        delta_key = options.get('delta_key')
+        backend_options = {}
+        for option in ('compact','typed_columns'):
+            if options.get(option):
+                backend_options[option] = True
+        for option in ('encoding','delimiter'):
+            if options.get(option):
+                backend_options[option] = options.get(option)
+        try:
+            jobs = int(options.get('jobs'))
+        except ValueError:
+            raise CommandError( \
+                u"Supplied value for `jobs` is not a valid integer.")
 
         backend_name = options.get('backend_name')
         db_name = options.get('backend_db_name')
 
         if not len(datafiles):
             raise CommandError("You must specify a datafile from which to load data.")
+        if delta_key and jobs > 1:
+            raise CommandError( \
+                u"Incremental imports (`delta-key`) cannot be run in parallel (`jobs`).")
+        if delta_key and bulk:
+            raise CommandError( \
+                u"Incremental imports (`delta-key`) cannot be loaded in `bulk`; they must be able to roll back.")
+        if delta_key and limit:
+            raise CommandError( \
+                u"Incremental imports (`delta-key`) cannot be limited; unread records would be marked removed.")
         if limit:
             print "Importing %d elements" % (limit)
         if indexes:
@@ -73,20 +181,46 @@ class Command(BaseCommand):
 
         print "Using backend=%s and destination=%s" % (backend_name,backend_db_name)
 
+        tasks = []
         for datafile in datafiles:
-            if not tablespace:
-                tablespace, ext = datafile.rsplit('/',1)[1].split('.')
-            print "Loading from %s -> %s" % (datafile,tablespace)
-
-            backend = backend_module.Backend(limit)
-            backend.parse(datafile=datafile)
-            data = backend.get_data()
-            fields = backend.get_fields()
-
-            db = MigrationDatabase(backend_db_name)
-            print "Dropping %s" % (tablespace)
-            db.delete_tablespace(tablespace)
-            print "(Re)loading %s" % (tablespace)
-            db.create_tablespace(tablespace,fields)
-            db.create_indexes(tablespace,indexes)
-            db.load_objects(tablespace,fields,data)
+            datafile_tablespace = tablespace
+            if not datafile_tablespace:
+                datafile_tablespace, ext = datafile.rsplit('/',1)[1].split('.')
+            print "Loading from %s -> %s" % (datafile,datafile_tablespace)
+            tasks.append( (datafile,datafile_tablespace) )
+
+        if jobs <= 1:
+            for datafile,datafile_tablespace in tasks:
+                load_datafile( \
+                    backend_module.__name__, datafile, datafile_tablespace, backend_db_name,
+                    limit=limit, indexes=indexes, bulk=bulk, batch_size=batch_size,
+                    delta_key=delta_key, backend_options=backend_options)
+            return
+
+        staging_tasks = []
+        for job,(datafile,datafile_tablespace) in enumerate(tasks):
+            staging_db_name = STAGING_DBNAME % {'db_name':backend_db_name, 'job':job}
+            staging_tasks.append( \
+                (backend_module.__name__, datafile, datafile_tablespace, staging_db_name, limit, batch_size,
+                 backend_options) )
+
+        print "Importing %d datafiles using %d jobs" % (len(staging_tasks),jobs)
+        column_types = {}
+        if options.get('typed_columns'):
+            column_types = backend_module.Backend.column_types
+        pool = multiprocessing.Pool(jobs)
+        try:
+            db = MigrationDatabase(backend_db_name,bulk=bulk)
+            # staging databases are merged in order as their workers finish
+            for datafile_tablespace,staging_db_name,fields,cnt in \
+                    pool.imap(load_staging_datafile,staging_tasks):
+                print "Merging %d records from %s -> %s" % (cnt,staging_db_name,datafile_tablespace)
+                db.merge_tablespace( \
+                    datafile_tablespace,fields,staging_db_name,column_types)
+                db.create_indexes(datafile_tablespace,indexes)
+                if bulk:
+                    db.analyze(datafile_tablespace)
+                os.remove("%s.sqlite3" % (staging_db_name))
+        finally:
+            pool.close()
+            pool.join()
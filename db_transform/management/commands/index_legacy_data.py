@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from db_migration.advisor import TablespaceIndexAdvisor
+from db_migration.plan import TablespaceMigrationPlan
+from db_migration import autodiscover
+
+from optparse import make_option
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--plan', action="store", dest='plan', default='',
+            help='Specify a migration plan to index for'),
+        make_option('--migration', action="store", dest='migration', default='',
+            help='Specify a particular migration'),
+        make_option('--group', action="store", dest='group', default='',
+            help='Specify a particular migration group'),
+        make_option('--dry-run', action="store_true", dest='dry_run', default=False,
+            help='Only report missing indexes and query plans'),
+    )
+    help = 'Creates the source tablespace indexes required by the (given) migrations'
+
+    def handle(self, **options):
+        plan = options.get('plan')
+        migration = options.get('migration')
+        group = options.get('group')
+        if group and not plan:
+            raise CommandError( \
+                u"You must supply a migration plan when specifying `group`")
+        dry_run = options.get('dry_run')
+
+        autodiscover()
+
+        # index for all registered migrations unless a plan or migration is given
+        migrations = None
+        if plan or migration:
+            plan = TablespaceMigrationPlan( \
+                planfile=plan,groupname=group)
+            if plan.is_empty() and migration:
+                plan.add_migration( migration )
+            migrations = plan.migrations
+
+        advisor = TablespaceIndexAdvisor(migrations)
+        for tablespace,columns in advisor.create_indexes(dry_run=dry_run):
+            if dry_run:
+                print "Missing indexes on %s: %s" % (tablespace,', '.join(columns))
+            else:
+                print "Created indexes on %s: %s" % (tablespace,', '.join(columns))
+
+        full_scans = 0
+        for description,tablespace,detail,full_scan in advisor.explain():
+            flag = '   '
+            if full_scan:
+                flag = '!! '
+                full_scans += 1
+            print "%s%s (%s): %s" % (flag,description,tablespace,detail)
+        print "%d full scan(s) remaining" % (full_scans)
@@ -1,5 +1,8 @@
 from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
 
+from db_migration.tablespace import MigrationDatabase, STAGING_MODES
+from db_migration.migration import DEFAULT_IDENTITY_MAP_SIZE
 from db_migration.plan import TablespaceMigrationPlan
 from db_migration import autodiscover
 
@@ -16,6 +19,28 @@ class Command(BaseCommand):
             help='Specify a particular migration group'),
         make_option('--limit', action="store", dest='limit', default=0,
             help='Integer argument to limit records listed'),
+        make_option('--changed-since', action="store", dest='changed_since', default=None,
+            help='Only migrate records changed by incremental imports after the given import'),
+        make_option('--staging-mode', action="store", dest='staging_mode', default='file',
+            help='Open staging databases as regular files (file), copied into memory (memory) '+
+                 'or memory-mapped (mmap)'),
+        make_option('--checkpoint', action="store_true", dest='checkpoint', default=False,
+            help='Record the last migrated row of each migration so that the run can be resumed'),
+        make_option('--resume', action="store_true", dest='resume', default=False,
+            help='Resume an interrupted run from the checkpoints it recorded'),
+        make_option('--transaction-size', action="store", dest='transaction_size', default=0,
+            help='Commit records the given number at a time'),
+        make_option('--identity-map-size', action="store", dest='identity_map_size',
+            default=DEFAULT_IDENTITY_MAP_SIZE,
+            help='Number of related objects remembered during the run (0 disables)'),
+        make_option('--jobs', action="store", dest='jobs', default=1,
+            help='Provide the number of migrations to run in parallel'),
+        make_option('--shards', action="store", dest='shards', default=0,
+            help='Split each migration into the given number of worker processes'),
+        make_option('--dry-run', action="store_true", dest='dry_run', default=False,
+            help='Only convert and validate records, without writing to the destination database'),
+        make_option('--profile', action="store_true", dest='profile', default=False,
+            help='Report the time taken by the conversions of each field (requires --dry-run)'),
     )
     help = 'Transforms source migration data stored in the given tablespace(s)'
 
@@ -27,6 +52,10 @@ class Command(BaseCommand):
             raise CommandError( \
                 u"You must supply a migration plan when specifying `group`")
 
+        if options.get('profile') and not options.get('dry_run'):
+            raise CommandError( \
+                u"`profile` requires `dry-run`")
+
         limit = options.get('limit')
         try:
             limit = long(limit)
@@ -34,8 +63,49 @@ class Command(BaseCommand):
             raise CommandError( \
                 u"Supplied value for `limit` is not a valid integer.")
 
+        changed_since = options.get('changed_since')
+        if changed_since is not None:
+            try:
+                changed_since = long(changed_since)
+            except ValueError:
+                raise CommandError( \
+                    u"Supplied value for `changed-since` is not a valid integer.")
+
+        try:
+            transaction_size = int(options.get('transaction_size'))
+        except ValueError:
+            raise CommandError( \
+                u"Supplied value for `transaction-size` is not a valid integer.")
+
+        try:
+            identity_map_size = int(options.get('identity_map_size'))
+        except ValueError:
+            raise CommandError( \
+                u"Supplied value for `identity-map-size` is not a valid integer.")
+
+        try:
+            jobs = int(options.get('jobs'))
+        except ValueError:
+            raise CommandError( \
+                u"Supplied value for `jobs` is not a valid integer.")
+
+        try:
+            shards = int(options.get('shards'))
+        except ValueError:
+            raise CommandError( \
+                u"Supplied value for `shards` is not a valid integer.")
+
+        staging_mode = options.get('staging_mode')
+        if staging_mode not in STAGING_MODES:
+            raise CommandError( \
+                u"Supplied value for `staging-mode` must be one of %s." % (', '.join(STAGING_MODES)))
+
         autodiscover()
 
+        # open the staging databases ahead of the migrations sharing them
+        for backend_name,db_name in getattr(settings,'DB_MIGRATION_BACKENDS',{}).values():
+            MigrationDatabase.get_database(db_name,mode=staging_mode)
+
         # open the plan if provided
         plan = TablespaceMigrationPlan( \
             planfile=plan,groupname=group)
@@ -45,4 +115,8 @@ class Command(BaseCommand):
             plan.add_migration( migration )
 
         # activate the migration plan
-        plan.run()
+        plan.run(limit=limit,changed_since=changed_since,
+                 checkpoint=options.get('checkpoint'),resume=options.get('resume'),
+                 transaction_size=transaction_size,identity_map_size=identity_map_size,
+                 shards=shards,jobs=jobs,
+                 dry_run=options.get('dry_run'),profile=options.get('profile'))
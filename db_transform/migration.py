@@ -1,20 +1,196 @@
-from django.core.exceptions import ObjectDoesNotExist
-from django.db import transaction, IntegrityError
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.core.validators import EMPTY_VALUES
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.query_utils import deferred_class_factory
+from django.db import transaction, router, connections, IntegrityError
 from django.forms.models import modelform_factory
 from django.db.models.query import QuerySet
 from django.conf import settings
 
-from db_migration.tablespace import MigrationDatabase
+from db_migration.tablespace import ( \
+    MigrationDatabase, BoundedCache, get_row_columns, DEFAULT_ARRAYSIZE, ROWID_COLUMN)
+from db_migration.purge import TablespacePurge, TablespacePurgeError
 from db_migration.conversion import ( \
     TablespaceValueConversion, SimpleConversion, ConcatinationConversion)
 
+from timeit import default_timer
+import multiprocessing
+import itertools
 import logging
+import Queue
 import copy
 
 
+# types of the lookup values which can be answered by a lookup index
+INDEXABLE_TYPES = (int,long,float,basestring)
+
+# marks lookup index entries shared by several objects
+AMBIGUOUS_LOOKUP = object()
+
+# marks the entries which did not exist before a savepoint (see
+# ``TablespaceMigrationContext.record_change``)
+UNSET = object()
+
+# number of related objects kept by the identity map of a run
+DEFAULT_IDENTITY_MAP_SIZE = 10000
+
+# seconds to wait for the result of a shard before checking its worker
+SHARD_POLL_INTERVAL = 1
+
+
 class TablespaceMigrationError(Exception):
     pass
 
+def iter_chunks(iterable, size):
+    """
+    Yields the items of ``iterable`` in lists of (at most) ``size`` items.
+
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator,size))
+        if not chunk:
+            break
+        yield chunk
+
+def get_rowid_ranges(max_rowid, shards):
+    """
+    Splits the rowids up to ``max_rowid`` into (at most) ``shards`` ranges of
+    consecutive rowids, given as (after rowid, last rowid) pairs.
+
+    """
+    size = max_rowid // shards + 1
+    return [(start,min(start + size,max_rowid)) for start in range(0,max_rowid,size)]
+
+def migrate_shard(migration, shard, rowid_range, queue, **options):
+    """
+    Migrates the records of ``migration`` in ``rowid_range`` in a forked
+    worker process and reports its counters (or its error) on ``queue``.
+
+    """
+    # connections of the parent process must not be shared
+    for connection in connections.all():
+        connection.connection = None
+    MigrationDatabase.reconnect_databases()
+    # only the counters of the shard are reported
+    for cache in (migration.db.object_cache,migration.context.identity_map):
+        if cache is not None:
+            cache.hits = cache.misses = 0
+
+    result = {'shard': shard, 'rows': 0, 'error': None}
+    try:
+        result['rows'] = migration.migrate_rowid_range(rowid_range,**options)
+    except Exception, e:
+        logging.exception( "Shard %d of %s failed" % (shard,migration.__class__.__name__) )
+        result['error'] = str(e)
+    result['cache'] = migration.db.get_cache_stats()
+    result['identity_map'] = migration.context.get_identity_map_stats()
+    queue.put( result )
+
+class ConversionTimer(object):
+    """
+    Stands in for a convertor of a profiled ``TablespaceFieldPlan`` and adds
+    the conversions it makes, and the time they take, to ``timing``.
+
+    """
+    def __init__(self, convertor, timing):
+        self.convertor = convertor
+        self.field_name = convertor.field_name
+        self.timing = timing
+
+    def convert(self, raw_value, raw_object, form_data):
+        start = default_timer()
+        try:
+            return self.convertor.convert(raw_value,raw_object,form_data)
+        finally:
+            self.timing[0] += 1
+            self.timing[1] += default_timer() - start
+
+class TablespaceFieldPlan(object):
+    """
+    A field map compiled into a flat list of (key, convertor, source field,
+    map value) entries, so that records are converted without re-examining
+    the map. ``bind`` returns the entries with their source fields replaced
+    by column indices for a given row layout.
+
+    With ``direct_reads`` (for maps converted against the source row itself)
+    plain ``SimpleConversion`` entries, which only read their source field,
+    are compiled to a direct read: their convertor is None.
+
+    """
+    def __init__(self, migration, field_map, direct_reads=False):
+        self.entries = []
+        for key,value in field_map.iteritems():
+            if value is None:
+                logging.info("key=%s has been explicitly removed in tablespace=%s. Skipping." % \
+                                 (key,migration.tablespace))
+                continue
+            convertor = migration.get_convertor(key,value)
+            if convertor.field_name is None:
+                logging.info( \
+                    "%s.field_name explicitly unset. Converting the map value of key=%s instead." % \
+                        (convertor.__class__.__name__,key))
+            field_name = convertor.field_name
+            if direct_reads and type(convertor) is SimpleConversion:
+                convertor = None
+            self.entries.append( (key,convertor,field_name,value) )
+        # the compiled entries, which ``profile`` wraps
+        self.original_entries = self.entries
+        self.bindings = {}
+        # the rows of a page share their columns (see ``get_row_columns``), so
+        # the last binding is kept apart to spare hashing them for every row
+        self.last_binding = (None,None)
+
+    def bind(self, columns):
+        """
+        Returns the entries for rows whose columns are named ``columns``
+        (see ``get_row_columns``), or the unbound entries if ``columns`` is
+        None. Like row lookups, names are matched case-insensitively and the
+        first column of a name wins.
+
+        """
+        if columns is None:
+            return self.entries
+        if columns is self.last_binding[0]:
+            return self.last_binding[1]
+        try:
+            entries = self.bindings[columns]
+            self.last_binding = (columns,entries)
+            return entries
+        except KeyError:
+            pass
+
+        indices = {}
+        for i,name in enumerate(columns):
+            indices.setdefault(name.lower(),i)
+        entries = []
+        for key,convertor,field_name,value in self.entries:
+            if field_name is not None:
+                field_name = indices.get(field_name.lower(),field_name)
+            entries.append( (key,convertor,field_name,value) )
+        self.bindings[columns] = entries
+        self.last_binding = (columns,entries)
+        return entries
+
+    def profile(self):
+        """
+        Has the conversions of the plan timed and returns the timings: a
+        [conversions, seconds] pair for each key, updated as records are
+        converted. Each call starts over from the compiled conversions.
+
+        """
+        timings = {}
+        entries = []
+        for key,convertor,field_name,value in self.original_entries:
+            if convertor is not None:
+                timings[key] = [0,0.0]
+                convertor = ConversionTimer(convertor,timings[key])
+            entries.append( (key,convertor,field_name,value) )
+        self.entries = entries
+        self.bindings = {}
+        self.last_binding = (None,None)
+        return timings
+
 class TablespaceMigrationOptions(object):
     backend = 'default'
     tablespace = ''
@@ -35,6 +211,31 @@ class TablespaceMigrationOptions(object):
     lookup = {}
     defaults = {}
 
+    # number of source lookups (``get_raw_object``) kept in a LRU cache
+    raw_cache_size = 0
+    # number of source rows fetched at a time while migrating
+    arraysize = DEFAULT_ARRAYSIZE
+    # record the last migrated source row so that an interrupted run can be resumed
+    checkpoint = False
+    # fetch the related raw objects of each chunk of rows in bulk (see ``prefetch_relations``)
+    prefetch_relations = True
+    # write objects with ``bulk_create`` instead of saving a form per row (see ``bulk_migrate_objects``)
+    bulk = False
+    # number of objects written per INSERT in bulk mode
+    bulk_size = 500
+    # validate every n-th object in bulk mode (1 validates all of them, 0 none)
+    bulk_validate = 1
+    # number of records committed at a time, each within a savepoint (0 commits every record)
+    transaction_size = 0
+    # answer ``get_object`` from an index of the pks of the model's objects, loaded
+    # in one query per set of lookup fields (see ``get_lookup_index``)
+    preload_lookup = False
+    # purge the objects replaced by a run with set-based statements (see ``purge``)
+    fast_purge = False
+    # number of worker processes migrating rowid ranges of the tablespace (see
+    # ``migrate_shards``)
+    shards = 0
+
     def __init__(self, opts):
         if opts:
             for key,value in opts.__dict__.iteritems():
@@ -84,12 +285,99 @@ class TablespaceMigrationBase(type):
         setattr(new_class, '_meta', meta)
         return new_class
 
+class TablespaceMigrationContext(object):
+    """
+    State shared by the migrations taking part in a single run. Migrations are
+    instantiated once per (class, tablespace) and reused by every relation
+    binding which refers to them.
+
+    """
+    def __init__(self, identity_map_size=DEFAULT_IDENTITY_MAP_SIZE):
+        self.migrations = {}
+        # whether records are being migrated within a chunk transaction (see
+        # ``TablespaceMigration.migrate_chunk``)
+        self.chunked = False
+        # pks of destination objects by (model, lookup fields) and lookup values
+        # (see ``TablespaceMigration.get_lookup_index``)
+        self.lookup_indexes = {}
+        # related objects resolved by relation bindings, by (migration, lookup)
+        # (see ``TablespaceRelationBinding.handle``)
+        self.identity_map = None
+        if identity_map_size:
+            self.identity_map = BoundedCache(identity_map_size)
+        # whether related objects are only looked up, not migrated (see
+        # ``TablespaceMigration.dry_run``)
+        self.dry_run = False
+        # entries of the lookup indexes and the identity map set since the
+        # current savepoint, if any (see ``savepoint``)
+        self.changes = None
+
+    def invalidate(self):
+        """
+        Forgets the destination objects known to the run, e.g. once some of
+        them have been deleted or rolled back.
+
+        """
+        self.lookup_indexes.clear()
+        if self.identity_map is not None:
+            self.identity_map.clear()
+        self.changes = None
+
+    def savepoint(self):
+        """
+        Starts recording the entries set in the lookup indexes and the
+        identity map, so that ``savepoint_rollback`` can revert them alone.
+
+        """
+        self.changes = []
+
+    def record_change(self, mapping, key, previous=UNSET):
+        """
+        Records that ``key`` is about to be set in ``mapping`` (over
+        ``previous``, if it had an entry) while a savepoint is recorded.
+
+        """
+        if self.changes is not None:
+            self.changes.append( (mapping,key,previous) )
+
+    def savepoint_rollback(self):
+        """
+        Reverts the entries recorded since ``savepoint``, the objects they
+        refer to having been rolled back.
+
+        """
+        for mapping,key,previous in reversed(self.changes or []):
+            if previous is UNSET:
+                mapping.pop(key,None)
+            else:
+                mapping[key] = previous
+        self.changes = None
+
+    def savepoint_commit(self):
+        self.changes = None
+
+    def get_identity_map_stats(self):
+        if self.identity_map is None:
+            return {'size':0, 'hits':0, 'misses':0}
+        return {'size':len(self.identity_map),
+                'hits':self.identity_map.hits,
+                'misses':self.identity_map.misses}
+
+    def register_migration(self, migration):
+        self.migrations[(migration.__class__,migration.tablespace)] = migration
+
+    def get_migration(self, migration_cls, tablespace=None):
+        try:
+            return self.migrations[(migration_cls,tablespace or migration_cls._meta.tablespace)]
+        except KeyError:
+            return migration_cls(tablespace=tablespace,context=self)
+
 class TablespaceMigration(object):
     """ """
     __metaclass__ = TablespaceMigrationBase
 
     # def __init__(self, tablespace=None, dependent_migration=False):
-    def __init__(self, tablespace=None):
+    def __init__(self, tablespace=None, context=None):
         if not self._meta.model:
             raise TablespaceMigrationError( \
                 u"`model` must be specified on the Meta innerclass (%s)" % (self))
@@ -113,6 +401,9 @@ class TablespaceMigration(object):
         self.presave_relation_map = self._meta.presave_relation_map
         self.postsave_relation_map = self._meta.postsave_relation_map
 
+        self.presave_field_plan = TablespaceFieldPlan(self,self.presave_field_map,direct_reads=True)
+        self.postsave_field_plan = TablespaceFieldPlan(self,self.postsave_field_map)
+
         self.model_cls = self._meta.model
         if self._meta.form:
             self.form_cls = self._meta.form
@@ -123,6 +414,14 @@ class TablespaceMigration(object):
         self.lookup = self._meta.lookup
         self.defaults = self._meta.defaults
 
+        self.bulk = self._meta.bulk
+        if self.bulk:
+            self.check_bulk()
+        # number of objects built in bulk mode (see ``build_instance``)
+        self.bulk_count = 0
+        # model class of the objects returned by ``get_deferred_object``
+        self.deferred_cls = None
+
         available_backends = {}
         try:
             available_backends = settings.DB_MIGRATION_BACKENDS
@@ -134,7 +433,37 @@ class TablespaceMigration(object):
         except KeyError, e:
             raise TablespaceMigrationError("%s"%e)
 
-        self.db = MigrationDatabase(db_name)
+        self.db = MigrationDatabase.get_database(db_name,cache_size=self._meta.raw_cache_size)
+
+        # relation bindings are instantiated once per migration (see ``get_relation``)
+        self.relations = {}
+        self.context = context
+        if self.context is None:
+            self.context = TablespaceMigrationContext()
+        self.context.register_migration(self)
+
+    def get_migration(self, migration_cls, tablespace=None):
+        """
+        Returns the instance of ``migration_cls`` for ``tablespace`` taking part
+        in the same run as this migration.
+
+        """
+        return self.context.get_migration(migration_cls,tablespace)
+
+    def get_relation(self, relation_cls):
+        """
+        Returns the instance of the relation binding ``relation_cls`` bound to
+        this migration.
+
+        """
+        try:
+            return self.relations[relation_cls]
+        except KeyError:
+            relation = self.relations[relation_cls] = relation_cls(parent_migration=self)
+            return relation
+
+    def get_checkpoint_name(self):
+        return "%s.%s" % (self.__class__.__module__,self.__class__.__name__)
 
     def get_raw_object(self, lookup):
         """
@@ -144,9 +473,118 @@ class TablespaceMigration(object):
         return self.db.get_object( \
             self.tablespace,lookup,self.additional_tablespaces)
 
-    def get_object(self, raw_object, extra_lookup={}):
+    def get_raw_objects_in(self, key, values):
+        """
+        Fetches the objects from the migration source whose ``key`` is one of
+        ``values``.
+
+        """
+        return self.db.get_objects_in( \
+            self.tablespace,key,values,self.additional_tablespaces)
+
+    def prefetch_relations(self, raw_objects):
+        """
+        Has the relation bindings fetch the related raw objects of
+        ``raw_objects`` ahead of their migration, a query per binding.
+
+        """
+        for relation_map in (self.presave_relation_map,self.postsave_relation_map):
+            for key,relations in relation_map.iteritems():
+                if type(relations) != tuple and type(relations) != list:
+                    relations = [relations,]
+                for relation_cls in relations:
+                    self.get_relation(relation_cls).prefetch(raw_objects)
+
+    def get_lookup_index(self, fields):
+        """
+        Returns a mapping of the values of ``fields`` (a sorted tuple of field
+        names) to the pks of the objects of the model, loading it on first use.
+        The index is shared by the migrations of the model in the run.
+
+        """
+        try:
+            return self.context.lookup_indexes[(self.model_cls,fields)]
+        except KeyError:
+            pass
+
+        index = {}
+        for row in self.model_cls.objects.values_list(*(fields + ('pk',))).iterator():
+            if row[:-1] in index:
+                index[row[:-1]] = AMBIGUOUS_LOOKUP
+            else:
+                index[row[:-1]] = row[-1]
+        # an index loaded within a savepoint may hold objects rolled back
+        self.context.record_change(self.context.lookup_indexes,(self.model_cls,fields))
+        self.context.lookup_indexes[(self.model_cls,fields)] = index
+        logging.info("Loaded %d %s objects by %s" % (len(index),self.model_cls.__name__,', '.join(fields)))
+        return index
+
+    def get_lookup_key(self, lookup):
+        """
+        Returns the (fields, values) under which ``lookup`` is found in a
+        lookup index, or None if it cannot be answered by one.
+
+        """
+        fields = tuple(sorted(lookup.keys()))
+        values = []
+        for name in fields:
+            value = lookup[name]
+            if not isinstance(value,INDEXABLE_TYPES):
+                return None
+            try:
+                field = self.model_cls._meta.get_field(name)
+            except FieldDoesNotExist:
+                return None
+            if field in self.model_cls._meta.many_to_many:
+                return None
+            if field.rel:
+                field = field.rel.get_related_field()
+            try:
+                values.append( field.to_python(value) )
+            except ValidationError:
+                return None
+        return (fields,tuple(values))
+
+    def update_lookup_indexes(self, instance):
+        """
+        Adds the (newly saved) ``instance`` to the lookup indexes of its model.
+
+        """
+        for (model_cls,fields),index in self.context.lookup_indexes.iteritems():
+            if model_cls is not self.model_cls:
+                continue
+            key = tuple([getattr(instance,model_cls._meta.get_field(name).attname) for name in fields])
+            self.context.record_change(index,key,index.get(key,UNSET))
+            if index.get(key,instance.pk) != instance.pk:
+                index[key] = AMBIGUOUS_LOOKUP
+            else:
+                index[key] = instance.pk
+
+    def clear_lookup_indexes(self):
+        for model_cls,fields in self.context.lookup_indexes.keys():
+            if model_cls is self.model_cls:
+                del self.context.lookup_indexes[(model_cls,fields)]
+
+    def get_deferred_object(self, pk):
+        """
+        Returns the object given by ``pk`` without querying for it: its fields
+        (but the pk) are loaded on first access.
+
+        """
+        if self.deferred_cls is None:
+            opts = self.model_cls._meta
+            self.deferred_cls = deferred_class_factory( \
+                self.model_cls,[field.attname for field in opts.fields if field is not opts.pk])
+        instance = self.deferred_cls(**{self.model_cls._meta.pk.attname:pk})
+        instance._state.adding = False
+        instance._state.db = router.db_for_read(self.model_cls)
+        return instance
+
+    def get_object(self, raw_object, extra_lookup={}, deferred=False):
         """
         Fetches the object from the migration destination (if it exists).
+        With ``deferred``, objects found in the lookup index are returned as
+        by ``get_deferred_object``.
 
         """
         if not self.lookup and not extra_lookup:
@@ -177,6 +615,24 @@ class TablespaceMigration(object):
         #                 if related_obj:
         #                     relation.add_to_lookup( obj_attrs, key, related_obj )
 
+        # objects missing from the lookup index are not queried for; those
+        # found are fetched by pk
+        lookup_key = None
+        if self._meta.preload_lookup:
+            lookup_key = self.get_lookup_key(lookup)
+        if lookup_key is not None:
+            pk = self.get_lookup_index(lookup_key[0]).get(lookup_key[1])
+            if pk is None:
+                logging.warn( \
+                    "%(class_name)s get_object: No object matching %(lookup)s in lookup index" % \
+                        {'class_name':self.__class__.__name__,
+                         'lookup':lookup})
+                return None
+            if pk is not AMBIGUOUS_LOOKUP and deferred:
+                return self.get_deferred_object(pk)
+            if pk is not AMBIGUOUS_LOOKUP:
+                lookup = {'pk':pk}
+
         try:
             return self.model_cls.objects.get(**lookup)
         except ObjectDoesNotExist, e:
@@ -186,27 +642,34 @@ class TablespaceMigration(object):
                      'error':'%s'%e})
         return None
 
-    def process_field(self, key, value, raw_object):
-        """ """
-        convertor = None
-        conversion_value = value
+    def get_convertor(self, key, value):
+        """
+        Returns the conversion given by the field map ``value`` of ``key``.
 
+        """
         # 'somekey': 'someotherfield'
         if type(value) == str or type(value) == unicode:
-            convertor = SimpleConversion(field_name=value)
+            return SimpleConversion(field_name=value)
         # 'somekey': ('fieldone','fieldtwo')
         elif type(value) == tuple:
-            convertor = ConcatinationConversion()
+            return ConcatinationConversion()
         # 'somekey': SomeConversion (instance)
         elif isinstance(value,TablespaceValueConversion):
-            convertor = value
+            return value
         # 'somekey': SomeConversionCls
         else:
             try:
                 if issubclass(value,TablespaceValueConversion):
-                    convertor = value()
+                    return value()
             except TypeError:
                 pass
+        raise TablespaceMigrationError( \
+            u"Invalid field map value %s for key=%s (%s)" % (value,key,self.__class__.__name__))
+
+    def process_field(self, key, value, raw_object):
+        """ """
+        convertor = self.get_convertor(key,value)
+        conversion_value = value
 
         if convertor.field_name is not None:
             conversion_value = raw_object[convertor.field_name]
@@ -224,37 +687,58 @@ class TablespaceMigration(object):
 
         objs = []
         for relation_cls in relations:
-            relation = relation_cls(parent_migration=self)
+            relation = self.get_relation(relation_cls)
             objs.append( (relation,relation.handle(raw_object,instance)) )
 
         return objs
 
-    @transaction.commit_on_success()
-    def migrate_object(self, raw_object, instance=None, initial={}):
-        """ """
+    def check_bulk(self):
+        """
+        Raises a ``TablespaceMigrationError`` unless the migration can be
+        written in bulk: objects must be new and need no relations set once
+        they have been saved.
+
+        """
+        if self.update:
+            raise TablespaceMigrationError( \
+                u"`bulk` cannot be combined with `update` (%s)" % (self.__class__.__name__))
+        if self.postsave_relation_map:
+            raise TablespaceMigrationError( \
+                u"`bulk` cannot be combined with a `postsave_relation_map` (%s)" % (self.__class__.__name__))
+        many_to_many = set([field.name for field in self.model_cls._meta.many_to_many])
+        keys = set(self.presave_field_map.keys() + self.presave_relation_map.keys() + self.postsave_field_map.keys())
+        if many_to_many & keys:
+            raise TablespaceMigrationError( \
+                u"`bulk` cannot set many-to-many fields %s (%s)" % \
+                    (', '.join(many_to_many & keys),self.__class__.__name__))
+
+    def get_form_data(self, raw_object, initial={}, columns=None):
+        """
+        Returns the form data given by ``raw_object``: the converted pre-save
+        fields and the pre-save relations. ``columns`` gives the column names
+        of ``raw_object`` so that fields are read by index (see
+        ``TablespaceFieldPlan.bind``).
+
+        """
         form_data = self.defaults.copy()
         form_data.update( initial )
 
-        if not instance:
-            instance = self.get_object(raw_object)
-
         # 
         # PRE-SAVE FIELDS
         #
-        for key, value in self.presave_field_map.iteritems():
-            logging.info("presave_field: %s:%s" % (key,value))            
-            if value is None:
-                logging.info("key=%s has been explicitly removed in tablespace=%s. Skipping." % \
-                                 (key,self.tablespace))
-                continue
-
+        for key,convertor,source,value in self.presave_field_plan.bind(columns):
             try:
+                if convertor is None:
+                    form_data[key] = raw_object[source]
+                    continue
                 #
                 # TODO: remove `form_data` argument from Conversion objects?
                 #
-                convertor,conversion_value = self.process_field(key,value,raw_object)
+                conversion_value = value
+                if source is not None:
+                    conversion_value = raw_object[source]
                 form_data[key] = convertor.convert(conversion_value,raw_object,form_data)
-            except IndexError, e:
+            except IndexError:
                 logging.info("Unable to index key=%s in form or value=%s in tablespace=%s. Skipping." % \
                                  (key,value,self.tablespace))
 
@@ -270,6 +754,49 @@ class TablespaceMigration(object):
                     logging.warn("Related object of type=%s not created from %s" % \
                                      (relation.__class__,dict(raw_object)))
 
+        return form_data
+
+    def set_postsave_fields(self, instance, raw_object, form_data, columns=None):
+        """
+        Sets the post-save fields on ``instance``.
+
+        """
+        for instance_key,convertor,source,form_key in self.postsave_field_plan.bind(columns):
+            try:
+                conversion_value = form_key
+                if source is not None:
+                    conversion_value = raw_object[source]
+                instance_value = convertor.convert(conversion_value,form_data,None)
+                setattr(instance,instance_key,instance_value)
+            except IndexError:
+                logging.info( \
+                    "Unable to index key=%s in tablespace=%s. Skipping." % \
+                        (convertor.field_name,self.tablespace))
+            except KeyError:
+                logging.info( \
+                    "Unable to index key=%s in form in tablespace=%s. Skipping." % \
+                        (form_key,self.tablespace))
+            except AttributeError:
+                logging.info( \
+                    "Unable to set attribute=%s on instance=%s in tablespace=%s. Skipping." % \
+                        (instance_key,instance,self.tablespace))
+
+    def migrate_object(self, raw_object, instance=None, initial={}, columns=None):
+        """
+        Migrates ``raw_object`` in a transaction of its own, or within the
+        chunk transaction of the run (see ``migrate_chunk``).
+
+        """
+        if self.context.chunked:
+            return self._migrate_object(raw_object,instance,initial,columns)
+        return transaction.commit_on_success()(self._migrate_object)(raw_object,instance,initial,columns)
+
+    def _migrate_object(self, raw_object, instance=None, initial={}, columns=None):
+        if not instance:
+            instance = self.get_object(raw_object)
+
+        form_data = self.get_form_data(raw_object,initial,columns)
+
         #
         # FORM POPULATION
         #
@@ -279,6 +806,9 @@ class TablespaceMigration(object):
                 try:
                     instance = f.save()
                 except Exception, e:
+                    # the failed statement has to be rolled back within a chunk transaction
+                    if self.context.chunked:
+                        raise
                     logging.warn( "Error in instantiation: %s" % (str(e)) )
             else:
                 logging.warn( "Error in object creation: %s" % (f.errors) )
@@ -291,27 +821,10 @@ class TablespaceMigration(object):
         #
         # POST-SAVE FIELDS
         # 
-        for instance_key,form_key in self.postsave_field_map.iteritems():
-            logging.info("postsave_field: %s:%s" % (instance_key,form_key))
-
-            try:
-                convertor,conversion_value = self.process_field(instance_key,form_key,raw_object)
-                instance_value = convertor.convert(conversion_value,form_data,None)
-                setattr(instance,instance_key,instance_value)
-            except IndexError:
-                logging.info( \
-                    "Unable to index key=%s in tablespace=%s. Skipping." % \
-                        (convertor.field_name,self.tablespace))
-            except KeyError:
-                logging.info( \
-                    "Unable to index key=%s in form in tablespace=%s. Skipping." % \
-                        (form_key,self.tablespace))
-            except AttributeError:
-                logging.info( \
-                    "Unable to set attribute=%s on instance=%s in tablespace=%s. Skipping." % \
-                        (instance_key,instance,self.tablespace))
+        self.set_postsave_fields(instance,raw_object,form_data,columns)
 
         instance.save()
+        self.update_lookup_indexes(instance)
 
         #
         # POST-SAVE RELATIONS
@@ -322,29 +835,438 @@ class TablespaceMigration(object):
 
         return instance
 
-    def handle(self, limit=0):
-        """ """
-        if not self.update:
+    def migrate_chunk(self, raw_objects, columns=None):
+        """
+        Migrates ``raw_objects`` in a single transaction, each within a
+        savepoint so that a failing record is rolled back (and skipped) alone.
+        Where the database does not support savepoints, a failing chunk is
+        rolled back as a whole and its records are migrated one transaction at
+        a time instead.
+
+        """
+        using = router.db_for_write(self.model_cls)
+        savepoints = connections[using].features.uses_savepoints
+
+        failed = False
+        transaction.enter_transaction_management(using=using)
+        transaction.managed(True,using=using)
+        self.context.chunked = True
+        try:
+            for raw_object in raw_objects:
+                sid = transaction.savepoint(using=using)
+                if savepoints:
+                    self.context.savepoint()
+                try:
+                    self._migrate_object(raw_object,columns=columns)
+                except Exception, e:
+                    if not savepoints:
+                        raise
+                    transaction.savepoint_rollback(sid,using=using)
+                    # only the objects known since the savepoint are gone
+                    self.context.savepoint_rollback()
+                    logging.warn( "Unable to migrate %s: %s" % (dict(raw_object),str(e)) )
+                else:
+                    transaction.savepoint_commit(sid,using=using)
+                    self.context.savepoint_commit()
+            transaction.commit(using=using)
+        except Exception, e:
+            transaction.rollback(using=using)
+            self.context.invalidate()
+            if savepoints:
+                raise
+            logging.warn( "Error in chunk transaction: %s. Migrating records one at a time." % (str(e)) )
+            failed = True
+        finally:
+            self.context.chunked = False
+            transaction.leave_transaction_management(using=using)
+
+        if failed:
+            for raw_object in raw_objects:
+                try:
+                    self.migrate_object(raw_object,columns=columns)
+                except Exception, e:
+                    logging.warn( "Unable to migrate %s: %s" % (dict(raw_object),str(e)) )
+
+    def check_shards(self):
+        """
+        Raises a ``TablespaceMigrationError`` unless the migration can be split
+        into shards: all related objects are resolved ahead of the shards (see
+        ``resolve_relations``), which leaves out relations set once an object
+        has been saved.
+
+        """
+        if self.postsave_relation_map:
+            raise TablespaceMigrationError( \
+                u"`shards` cannot be combined with a `postsave_relation_map` (%s)" % (self.__class__.__name__))
+
+    def resolve_relations(self, raw_objects):
+        """
+        Resolves (and migrates, if need be) the pre-save related objects of
+        ``raw_objects``, filling the identity map of the run.
+
+        """
+        for raw_object in raw_objects:
+            for key, relations in self.presave_relation_map.iteritems():
+                self.process_relation(key,relations,raw_object)
+
+    def migrate_records(self, records, transaction_size=0):
+        """
+        Migrates a page of ``records`` in chunks of ``transaction_size`` (the
+        whole page in bulk mode, one record at a time otherwise).
+
+        """
+        # the records of a page share their layout
+        columns = get_row_columns(records[0])
+        chunk_size = transaction_size or 1
+        if self.bulk:
+            chunk_size = len(records)
+        for i in range(0,len(records),chunk_size):
+            chunk = records[i:i + chunk_size]
+            if self.bulk:
+                self.bulk_migrate_objects(chunk,columns)
+            elif transaction_size:
+                self.migrate_chunk(chunk,columns)
+            else:
+                self.migrate_object(chunk[0],columns=columns)
+
+    def migrate_rowid_range(self, rowid_range, changed_since=None, transaction_size=0):
+        """
+        Migrates the records whose rowid falls within ``rowid_range`` and
+        returns their number.
+
+        """
+        cnt = 0
+        for records in self.db.iter_object_pages( \
+                self.tablespace,self.conditions,self.additional_tablespaces,
+                after_rowid=rowid_range[0],to_rowid=rowid_range[1],
+                pagesize=self._meta.arraysize,changed_since=changed_since):
+            if self._meta.prefetch_relations:
+                self.prefetch_relations(records)
+            self.migrate_records(records,transaction_size)
+            cnt += len(records)
+        return cnt
+
+    def migrate_shards(self, shards, changed_since=None, transaction_size=0):
+        """
+        Splits the tablespace into ``shards`` rowid ranges and migrates each
+        in a worker process of its own, with its own connections. Related
+        objects are resolved beforehand, in this process, so that workers
+        find them in the identity map (or the destination database) instead
+        of racing to create them. The counters of the workers are merged and
+        a ``TablespaceMigrationError`` is raised if any of them failed.
+
+        """
+        self.check_shards()
+
+        print "%s resolving related objects" % (self.__class__.__name__)
+        for records in iter_chunks(self.db.iter_objects( \
+                self.tablespace,self.conditions,self.additional_tablespaces,
+                arraysize=self._meta.arraysize,changed_since=changed_since),self._meta.arraysize):
+            if self._meta.prefetch_relations:
+                self.prefetch_relations(records)
+            self.resolve_relations(records)
+
+        queue = multiprocessing.Queue()
+        workers = []
+        for shard,rowid_range in enumerate(get_rowid_ranges(self.db.get_max_rowid(self.tablespace),shards)):
+            worker = multiprocessing.Process( \
+                target=migrate_shard, args=(self,shard,rowid_range,queue),
+                kwargs={'changed_since':changed_since,'transaction_size':transaction_size})
+            worker.start()
+            workers.append( worker )
+        print "%s migrating %d shards" % (self.__class__.__name__,len(workers))
+
+        # results are collected before joining the workers, which would
+        # otherwise wait for the queue to be read
+        results = []
+        while len(results) < len(workers):
+            try:
+                results.append( queue.get(timeout=SHARD_POLL_INTERVAL) )
+            except Queue.Empty:
+                if not any(w.is_alive() for w in workers):
+                    # results put by workers which have just exited may
+                    # still be on their way
+                    while len(results) < len(workers):
+                        try:
+                            results.append( queue.get(timeout=SHARD_POLL_INTERVAL) )
+                        except Queue.Empty:
+                            break
+                    break
+        for worker in workers:
+            worker.join()
+
+        rows = sum([result['rows'] for result in results])
+        cache_hits = sum([result['cache']['hits'] for result in results])
+        cache_misses = sum([result['cache']['misses'] for result in results])
+        identity_hits = sum([result['identity_map']['hits'] for result in results])
+        identity_misses = sum([result['identity_map']['misses'] for result in results])
+        print "%s migrated %d records in %d shards" % (self.__class__.__name__,rows,len(workers))
+        print "%s shard source lookup cache: %d hits, %d misses" % \
+            (self.__class__.__name__,cache_hits,cache_misses)
+        print "%s shard identity map: %d hits, %d misses" % \
+            (self.__class__.__name__,identity_hits,identity_misses)
+
+        # the objects known to this process predate the shards
+        self.context.invalidate()
+        errors = ["shard %d: %s" % (result['shard'],result['error']) for result in results if result['error']]
+        if len(results) < len(workers):
+            errors.append( "%d shard(s) exited without a result" % (len(workers) - len(results)) )
+        if errors:
+            raise TablespaceMigrationError( \
+                u"Unable to migrate %s: %s" % (self.__class__.__name__,'; '.join(errors)))
+
+    def validate_object(self, raw_object, columns=None):
+        """
+        Converts ``raw_object`` and validates its form (or, in bulk mode, its
+        object) like ``migrate_object`` does, without saving anything.
+        Returns whether it is valid.
+
+        """
+        if self.bulk:
+            return self.build_instance(raw_object,columns) is not None
+
+        instance = self.get_object(raw_object)
+        form_data = self.get_form_data(raw_object,columns=columns)
+        f = self.form_cls(form_data, instance=instance)
+        if not f.is_valid():
+            logging.warn( "Error in object creation: %s" % (f.errors) )
+            return False
+        self.set_postsave_fields(f.instance,raw_object,form_data,columns)
+        return True
+
+    def dry_run(self, limit=0, changed_since=None, profile=False):
+        """
+        Streams the records through the field conversions and validation of
+        ``validate_object`` without writing to the destination database:
+        nothing is purged and related objects are looked up but not
+        migrated. Reports the throughput and, with ``profile``, the time
+        taken by the conversions of each field.
+
+        """
+        self.context.dry_run = True
+        if profile:
+            timings = [('presave',self.presave_field_plan,self.presave_field_plan.profile()),
+                       ('postsave',self.postsave_field_plan,self.postsave_field_plan.profile())]
+
+        print "%s.dry_run with tablespace=%s" % (self.__class__.__name__,self.tablespace)
+
+        cnt = invalid = 0
+        start = default_timer()
+        for records in iter_chunks(self.db.iter_objects( \
+                self.tablespace,self.conditions,self.additional_tablespaces,
+                arraysize=self._meta.arraysize,limit=limit,changed_since=changed_since),self._meta.arraysize):
+            if self._meta.prefetch_relations:
+                self.prefetch_relations(records)
+            columns = get_row_columns(records[0])
+            for raw_object in records:
+                if not self.validate_object(raw_object,columns):
+                    invalid += 1
+            cnt += len(records)
+        elapsed = default_timer() - start
+
+        print "%s dry run: %d records (%d invalid) in %.2fs, %.1f records/sec" % \
+            (self.__class__.__name__,cnt,invalid,elapsed,cnt / elapsed if elapsed else 0.0)
+        if profile:
+            fields = []
+            for stage,field_plan,stage_timings in timings:
+                for key,convertor,field_name,value in field_plan.entries:
+                    if convertor is None:
+                        continue
+                    conversions,seconds = stage_timings[key]
+                    fields.append( (seconds,stage,key,convertor.convertor.__class__.__name__,conversions) )
+            for seconds,stage,key,convertor_name,conversions in sorted(fields,reverse=True):
+                print "    %s %s (%s): %d conversions, %.3fs, %.1f us/conversion" % \
+                    (stage,key,convertor_name,conversions,seconds,
+                     seconds * 1000000 / conversions if conversions else 0.0)
+
+    def build_instance(self, raw_object, columns=None):
+        """
+        Returns an unsaved model instance built from ``raw_object`` (or None
+        if it is invalid). Unlike ``migrate_object``, no form is involved:
+        values are converted by the model fields and only every
+        ``Meta.bulk_validate``-th instance is validated by them. As by form
+        fields, empty values are taken as None by fields which do not store
+        empty strings.
+
+        """
+        form_data = self.get_form_data(raw_object,columns=columns)
+
+        instance = self.model_cls()
+        try:
+            for field in self.model_cls._meta.fields:
+                if field.name in form_data:
+                    value = form_data[field.name]
+                    if value in EMPTY_VALUES and not field.empty_strings_allowed:
+                        value = None
+                    setattr(instance,field.attname,field.to_python(value))
+            self.set_postsave_fields(instance,raw_object,form_data,columns)
+
+            self.bulk_count += 1
+            if self._meta.bulk_validate and self.bulk_count % self._meta.bulk_validate == 0:
+                # uniqueness is left to the database
+                instance.clean_fields()
+                instance.clean()
+        except ValidationError, e:
+            logging.warn( "Error in object creation: %s" % (e.messages) )
+            return None
+        return instance
+
+    def bulk_migrate_objects(self, raw_objects, columns=None):
+        """
+        Builds the objects given by ``raw_objects`` and inserts them with
+        ``bulk_create``, ``Meta.bulk_size`` at a time. Should a batch fail,
+        its objects are saved one at a time instead and those which cannot be
+        are skipped. Model ``save`` methods and signals are bypassed.
+
+        """
+        instances = []
+        for raw_object in raw_objects:
+            instance = self.build_instance(raw_object,columns)
+            if instance is not None:
+                instances.append( instance )
+
+        for i in range(0,len(instances),self._meta.bulk_size):
+            batch = instances[i:i + self._meta.bulk_size]
+            try:
+                self._bulk_create(batch)
+            except Exception, e:
+                logging.warn( "Error in bulk creation: %s. Saving objects one at a time." % (str(e)) )
+                for instance in batch:
+                    try:
+                        self._save_instance(instance)
+                    except Exception, e:
+                        logging.warn( "Error in instantiation: %s" % (str(e)) )
+        # pks of objects created in bulk are unknown
+        self.clear_lookup_indexes()
+        return instances
+
+    @transaction.commit_on_success()
+    def _bulk_create(self, instances):
+        self.model_cls.objects.bulk_create(instances)
+
+    @transaction.commit_on_success()
+    def _save_instance(self, instance):
+        instance.save()
+
+    def purge(self, queryset):
+        """
+        Deletes the objects of ``queryset`` and those depending upon them.
+        With ``Meta.fast_purge`` this is done by set-based statements (see
+        ``TablespacePurge``) unless the models involved do not allow it.
+
+        """
+        if self._meta.fast_purge:
+            try:
+                purge = TablespacePurge(queryset)
+            except TablespacePurgeError, e:
+                logging.warning( "Unable to purge %s objects in bulk (%s). Deleting them one at a time." % \
+                                     (queryset.model.__name__,str(e)) )
+            else:
+                for model,field_name,cnt in purge.run():
+                    if field_name is None:
+                        print "Purged %d %s objects" % (cnt,model.__name__)
+                    else:
+                        print "Reset %s.%s of %d objects" % (model.__name__,field_name,cnt)
+                return
+        queryset.delete()
+
+    def handle(self, limit=0, changed_since=None, checkpoint=False, resume=False, transaction_size=0,
+               shards=0, dry_run=False, profile=False):
+        """
+        Migrates the records of the tablespace, or only those changed by
+        incremental imports after the import given by ``changed_since``.
+
+        With ``checkpoint`` (or ``Meta.checkpoint``) the tablespace is walked in
+        order of rowid and the last row of each migrated page is recorded in
+        the staging database; ``resume`` continues from the recorded row, if
+        any, and skips the migration if it has already completed.
+
+        With ``transaction_size`` (or ``Meta.transaction_size``) records are
+        committed that many at a time (see ``migrate_chunk``).
+
+        With ``shards`` (or ``Meta.shards``) greater than one, the records are
+        migrated by as many worker processes (see ``migrate_shards``).
+
+        With ``dry_run`` the records are only converted and validated (see
+        ``dry_run``).
+
+        """
+        if changed_since is not None and not self.update:
+            raise TablespaceMigrationError( \
+                u"Migrating changed records only (%s) requires `update` to be set" % (self.__class__.__name__))
+
+        if dry_run:
+            return self.dry_run(limit,changed_since,profile)
+
+        checkpoint = checkpoint or resume or self._meta.checkpoint
+        transaction_size = transaction_size or self._meta.transaction_size
+        shards = shards or self._meta.shards
+        if shards > 1 and (checkpoint or limit):
+            raise TablespaceMigrationError( \
+                u"`shards` cannot be combined with a checkpoint or a limit (%s)" % (self.__class__.__name__))
+        checkpoint_name = self.get_checkpoint_name()
+        after_rowid = 0
+        if checkpoint:
+            state = None
+            if resume:
+                state = self.db.get_checkpoint(checkpoint_name,self.tablespace)
+            if state is None:
+                self.db.clear_checkpoint(checkpoint_name,self.tablespace)
+            else:
+                after_rowid,completed = state
+                if completed:
+                    print "%s with tablespace=%s has already completed" % (self.__class__.__name__,self.tablespace)
+                    return
+                print "%s resuming after row %d" % (self.__class__.__name__,after_rowid)
+
+        # objects migrated before the checkpoint are kept when resuming
+        if not self.update and not after_rowid:
             for dependent_model_cls in self.dependent_models:
                 logging.warning( "Attribute `update_existing` is not set. Deleting all objects given by '%s'" % (dependent_model_cls.query))
-                if type(dependent_model_cls) == QuerySet: dependent_model_cls.delete()
-                else:                                     dependent_model_cls.objects.all().delete()
+                if type(dependent_model_cls) == QuerySet: self.purge(dependent_model_cls)
+                else:                                     self.purge(dependent_model_cls.objects.all())
             if self.queryset:
                 logging.warning( "Attribute `update_existing` is not set. Deleting all objects given by '%s'" % (self.queryset.all().query))
-                self.queryset.all().delete()
+                self.purge(self.queryset.all())
             else:
                 logging.warning( "Attribute `update_existing` is not set. Deleting all %s objects" % (self._meta.model))
-                self.model_cls.objects.all().delete()
+                self.purge(self.model_cls.objects.all())
+            self.context.invalidate()
 
         print "%s.migration_object with tablespace=%s" % (self.__class__.__name__,self.tablespace)
 
-        cnt = 1
+        if shards > 1:
+            return self.migrate_shards(shards,changed_since,transaction_size)
+
+        if checkpoint:
+            pages = self.db.iter_object_pages( \
+                self.tablespace,self.conditions,self.additional_tablespaces,
+                after_rowid=after_rowid,pagesize=self._meta.arraysize,limit=limit,changed_since=changed_since)
+        else:
+            pages = iter_chunks(self.db.iter_objects( \
+                self.tablespace,self.conditions,self.additional_tablespaces,
+                arraysize=self._meta.arraysize,limit=limit,changed_since=changed_since),self._meta.arraysize)
+
+        # records are committed in chunks of ``transaction_size`` (a page at a
+        # time in bulk mode, one at a time otherwise)
+        for records in pages:
+            if self._meta.prefetch_relations:
+                self.prefetch_relations(records)
+            self.migrate_records(records,transaction_size)
+            # pages hold every row joined to their rowids, so a resumed run
+            # replays at most the page which was interrupted
+            if checkpoint:
+                after_rowid = records[-1][ROWID_COLUMN]
+                self.db.save_checkpoint(checkpoint_name,self.tablespace,after_rowid)
+
+        # a limited run leaves its checkpoint to be resumed
+        if checkpoint and not limit:
+            self.db.save_checkpoint(checkpoint_name,self.tablespace,after_rowid,completed=True)
 
-        for record in self.db.get_objects(self.tablespace,self.conditions,self.additional_tablespaces):
-            self.migrate_object(record)
-            cnt += 1
-            if limit and cnt > limit:
-                break
+        if self.db.object_cache is not None:
+            stats = self.db.get_cache_stats()
+            print "%s source lookup cache: %d hits, %d misses" % \
+                (self.__class__.__name__,stats['hits'],stats['misses'])
 
 class TablespaceMigrationNotRegistered(Exception):
     pass
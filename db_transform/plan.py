@@ -1,12 +1,46 @@
-from db_migration.migration import TablespaceMigrationRegistry
+from django.db.models.query import QuerySet
+from django.db import connections
 
+from db_migration.migration import ( \
+    TablespaceMigrationRegistry, TablespaceMigrationContext, DEFAULT_IDENTITY_MAP_SIZE)
+from db_migration.tablespace import MigrationDatabase
+
+import multiprocessing
 import ConfigParser
 import logging
+import time
+
+
+# seconds between checks for finished workers of a parallel run
+POLL_INTERVAL = 0.1
 
 
 class TablespaceMigrationPlanError(Exception):
     pass
 
+def run_migration(migration_cls, context, options):
+    logging.info( "Running %s" % (migration_cls.__name__) )
+    migration = context.get_migration(migration_cls)
+    migration.handle(**options)
+
+def print_summary(context):
+    if context.identity_map is not None:
+        stats = context.get_identity_map_stats()
+        print "Related object identity map: %d hits, %d misses (%d objects)" % \
+            (stats['hits'],stats['misses'],stats['size'])
+
+def run_migration_worker(migration_cls, staging_modes, identity_map_size, options):
+    """
+    Runs ``migration_cls`` in a worker process of a parallel run, over
+    connections of its own.
+
+    """
+    for db_name,mode in staging_modes.iteritems():
+        MigrationDatabase.get_database(db_name,mode=mode)
+    context = TablespaceMigrationContext(identity_map_size=identity_map_size)
+    run_migration(migration_cls,context,options)
+    print_summary(context)
+
 class TablespaceMigrationPlan(object):
     """
     
@@ -14,12 +48,15 @@ class TablespaceMigrationPlan(object):
     """
     def __init__(self, planfile='', groupname=''):
         self.migrations = []
+        # indices of the migrations of each group, in order
+        self.groups = []
         if planfile:
             plan = ConfigParser.SafeConfigParser()
             plan.read( planfile )
             for group in plan.get('plan','groups').split():
                 if groupname and group != groupname:
                     continue
+                self.groups.append( [] )
                 for name in plan.get(group,'migrations').split():
                     self.add_migration( name )
 
@@ -29,10 +66,127 @@ class TablespaceMigrationPlan(object):
     def add_migration(self, migration_name):
         migration_cls = \
             TablespaceMigrationRegistry.get_migration(migration_name)
+        if not self.groups:
+            self.groups.append( [] )
+        self.groups[-1].append( len(self.migrations) )
         self.migrations.append( migration_cls )
 
-    def run(self):
+    def get_models(self, migration_cls):
+        """
+        Returns the models whose objects a run of ``migration_cls`` may create,
+        update, reference or delete, including through the migrations its
+        relation bindings run.
+
+        """
+        models = set()
+        visited = set()
+        migrations = [migration_cls]
+        while migrations:
+            migration_cls = migrations.pop()
+            if migration_cls in visited:
+                continue
+            visited.add( migration_cls )
+
+            meta = migration_cls._meta
+            models.add( meta.model )
+            for field in meta.model._meta.fields:
+                if field.rel:
+                    models.add( field.rel.to )
+            for dependent_model_cls in meta.dependent_models:
+                if type(dependent_model_cls) == QuerySet: models.add( dependent_model_cls.model )
+                else:                                     models.add( dependent_model_cls )
+            if meta.queryset is not None:
+                models.add( meta.queryset.model )
+
+            for relation_map in (meta.presave_relation_map,meta.postsave_relation_map):
+                for key,relations in relation_map.iteritems():
+                    if type(relations) != tuple and type(relations) != list:
+                        relations = [relations,]
+                    for relation_cls in relations:
+                        if relation_cls._meta.migration:
+                            migrations.append( relation_cls._meta.migration )
+        return models
+
+    def get_dependencies(self):
+        """
+        Returns the indices of the migrations each migration (by index) has to
+        wait for: those of the previous non-empty group and the earlier
+        migrations of its group which share models with it (see
+        ``get_models``). As dependencies always point to earlier migrations,
+        they form a DAG.
+
+        """
+        models = [self.get_models(migration_cls) for migration_cls in self.migrations]
+        dependencies = {}
+        # an empty group must not cut the ordering of the groups around it
+        previous_group = []
+        for group in self.groups:
+            for j,index in enumerate(group):
+                dependencies[index] = set(previous_group)
+                for earlier_index in group[:j]:
+                    if models[earlier_index] & models[index]:
+                        dependencies[index].add( earlier_index )
+            if group:
+                previous_group = group
+        return dependencies
+
+    def run(self, **options):
+        jobs = options.pop('jobs',1)
+        identity_map_size = options.pop('identity_map_size',DEFAULT_IDENTITY_MAP_SIZE)
+        if jobs > 1:
+            return self.run_parallel(jobs,identity_map_size,**options)
+
+        context = TablespaceMigrationContext(identity_map_size=identity_map_size)
         for migration_cls in self.migrations:
-            logging.info( "Running %s" % (migration_cls.__name__) )
-            migration = migration_cls()
-            migration.handle()
+            run_migration(migration_cls,context,options)
+        print_summary(context)
+
+    def run_parallel(self, jobs, identity_map_size=DEFAULT_IDENTITY_MAP_SIZE, **options):
+        """
+        Runs the migrations in up to ``jobs`` worker processes, each migration
+        as soon as those it depends upon (see ``get_dependencies``) have
+        completed. No further migration is started once one has failed.
+
+        """
+        dependencies = self.get_dependencies()
+
+        # workers open connections of their own, in the same staging modes
+        staging_modes = dict([(db_name,db.mode) for db_name,db in MigrationDatabase.databases.iteritems()])
+        MigrationDatabase.close_databases()
+        for connection in connections.all():
+            connection.close()
+
+        pending = range(len(self.migrations))
+        running = {}
+        completed = set()
+        failed = []
+        while pending or running:
+            for index in list(pending):
+                if failed or len(running) >= jobs:
+                    break
+                if dependencies[index] <= completed:
+                    pending.remove( index )
+                    worker = multiprocessing.Process( \
+                        target=run_migration_worker,
+                        args=(self.migrations[index],staging_modes,identity_map_size,options))
+                    worker.start()
+                    running[index] = worker
+                    print "Started %s (%d running)" % (self.migrations[index].__name__,len(running))
+            if not running:
+                break
+
+            time.sleep( POLL_INTERVAL )
+            for index,worker in running.items():
+                if worker.is_alive():
+                    continue
+                worker.join()
+                del running[index]
+                if worker.exitcode == 0:
+                    completed.add( index )
+                    print "Completed %s" % (self.migrations[index].__name__)
+                else:
+                    failed.append( self.migrations[index].__name__ )
+
+        if failed:
+            raise TablespaceMigrationPlanError( \
+                u"Migrations %s failed; %d migration(s) were not run" % (', '.join(failed),len(pending)))
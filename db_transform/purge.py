@@ -0,0 +1,156 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, router, transaction
+from django.db.models import signals
+from django.db.models.deletion import CASCADE, PROTECT, DO_NOTHING, ProtectedError
+from django.db.models.query import QuerySet
+
+import logging
+
+
+# number of pks deleted per statement where a table cannot be deleted from
+# through a subquery of itself (e.g. MySQL)
+DELETE_BATCH_SIZE = 500
+
+
+class TablespacePurgeError(Exception):
+    pass
+
+class FieldUpdateRecorder(object):
+    """
+    Stands in for the deletion collector of Django in order to find out the
+    value a ``SET_NULL``, ``SET_DEFAULT`` or ``SET(...)`` handler sets.
+
+    """
+    def add_field_update(self, field, value, objs):
+        self.value = value
+
+class TablespacePurge(object):
+    """
+    Deletes the objects of a queryset (or all objects of a model) along with
+    the objects depending upon them, without loading any of them: cascades
+    are planned from the model metadata and carried out by set-based
+    ``UPDATE``/``DELETE`` statements in dependency order, in one transaction.
+
+    Unlike ``QuerySet.delete`` no signals are sent, so models with delete
+    signal receivers are refused, as are inherited models and cyclic cascades
+    (a ``TablespacePurgeError`` is raised when planning).
+
+    """
+    def __init__(self, queryset):
+        if not isinstance(queryset,QuerySet):
+            queryset = queryset._default_manager.all()
+        self.queryset = queryset
+        self.using = router.db_for_write(queryset.model)
+        self.steps = []
+        self.plan(queryset,[])
+
+    def plan(self, queryset, path):
+        """
+        Appends the steps purging ``queryset`` to ``self.steps``: those of the
+        objects depending upon it first.
+
+        """
+        model = queryset.model
+        opts = model._meta
+        if opts.parents:
+            raise TablespacePurgeError( \
+                u"%s.%s inherits from another model" % (opts.app_label,opts.object_name))
+        for signal in (signals.pre_delete,signals.post_delete):
+            if signal.has_listeners(model):
+                raise TablespacePurgeError( \
+                    u"%s.%s has delete signal receivers" % (opts.app_label,opts.object_name))
+        path = path + [model]
+
+        for related in opts.get_all_related_objects(include_hidden=True,include_proxy_eq=True):
+            field = related.field
+            on_delete = field.rel.on_delete
+            if on_delete == DO_NOTHING:
+                continue
+            related_queryset = related.model._base_manager.using(self.using).filter( \
+                **{"%s__in" % field.name: queryset.values(field.rel.field_name)})
+
+            if on_delete == CASCADE:
+                if related.model in path:
+                    # all objects of the model are deleted by a single statement
+                    if related.model is model and not queryset.query.where.children:
+                        continue
+                    raise TablespacePurgeError( \
+                        u"Cascade from %s.%s through %s is cyclic" % (opts.app_label,opts.object_name,field))
+                self.plan(related_queryset,path)
+            elif on_delete == PROTECT:
+                self.steps.append( ('protect',related_queryset,field,None) )
+            else:
+                recorder = FieldUpdateRecorder()
+                try:
+                    on_delete(recorder,field,None,self.using)
+                    value = recorder.value
+                except AttributeError:
+                    raise TablespacePurgeError( \
+                        u"Unsupported on_delete handler of %s" % (field))
+                self.steps.append( ('update',related_queryset,field,value) )
+
+        # generic relations refer to the objects by content type and pk (and
+        # are listed with the many-to-many fields, as by the deletion collector)
+        for field in opts.virtual_fields + opts.many_to_many:
+            if not hasattr(field,'bulk_related_objects'):
+                continue
+            content_type = ContentType.objects.db_manager(self.using).get_for_model(model)
+            self.plan(field.rel.to._base_manager.using(self.using).filter( \
+                **{"%s__pk" % field.content_type_field_name: content_type.pk,
+                   "%s__in" % field.object_id_field_name: queryset.values('pk')}),path)
+
+        self.steps.append( ('delete',queryset,None,None) )
+
+    def delete(self, queryset):
+        """
+        Deletes the objects of ``queryset`` and returns their number.
+
+        """
+        connection = connections[self.using]
+        qn = connection.ops.quote_name
+        opts = queryset.model._meta
+        cursor = connection.cursor()
+
+        if not queryset.query.where.children:
+            cursor.execute( u"DELETE FROM %s" % (qn(opts.db_table)) )
+            return cursor.rowcount
+
+        if connection.features.update_can_self_select:
+            select_statement,params = queryset.values('pk').query.get_compiler(self.using).as_sql()
+            cursor.execute( u"DELETE FROM %s WHERE %s IN (%s)" % \
+                                (qn(opts.db_table),qn(opts.pk.column),select_statement), params )
+            return cursor.rowcount
+
+        pks = list(queryset.values_list('pk',flat=True))
+        cnt = 0
+        for i in range(0,len(pks),DELETE_BATCH_SIZE):
+            batch = pks[i:i + DELETE_BATCH_SIZE]
+            cursor.execute( u"DELETE FROM %s WHERE %s IN (%s)" % \
+                                (qn(opts.db_table),qn(opts.pk.column),', '.join(['%s' for pk in batch])), batch )
+            cnt += cursor.rowcount
+        return cnt
+
+    def run(self):
+        """
+        Carries out the purge and returns a (model, field name, rows) triple
+        per step: the number of objects deleted (field name None) or of
+        references set by ``on_delete``.
+
+        """
+        return transaction.commit_on_success(using=self.using)(self._run)()
+
+    def _run(self):
+        results = []
+        for action,queryset,field,value in self.steps:
+            if action == 'protect':
+                if queryset.exists():
+                    raise ProtectedError( \
+                        u"Cannot purge %s objects referenced through a protected foreign key: %s" % \
+                            (field.rel.to.__name__,field), queryset)
+            elif action == 'update':
+                results.append( (queryset.model,field.name,queryset.update(**{field.name:value})) )
+            else:
+                results.append( (queryset.model,None,self.delete(queryset)) )
+            logging.info("Purge step: %s %s" % (action,queryset.model.__name__))
+        transaction.set_dirty(using=self.using)
+        return results
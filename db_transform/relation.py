@@ -5,6 +5,14 @@ from django.forms.models import modelform_factory
 import logging
 
 
+def native_key_type(value):
+    """
+    ``key_type`` for keys stored in typed (e.g. NUMERIC) staging columns, which
+    already have the right type and are used as they are.
+
+    """
+    return value
+
 class TablespaceRelationBindingError(Exception):
     pass
 
@@ -90,10 +98,28 @@ class TablespaceRelationBinding(object):
         tablespace = None
         if not self._meta.migration._meta.tablespace:
             tablespace = self.parent_migration.tablespace
-        self.migration = self._meta.migration(tablespace=tablespace)
+        self.migration = self.parent_migration.get_migration(self._meta.migration,tablespace)
         self.update = self._meta.update
         self.fetch = self._meta.fetch
 
+        # related raw objects fetched ahead by ``prefetch``
+        self.prefetched = {}
+
+    def prefetch(self, raw_objects):
+        """
+        Hook to fetch the related raw objects of ``raw_objects`` in bulk ahead
+        of their handling.
+
+        """
+        pass
+
+    def get_related_raw_object(self, raw_lookup):
+        """
+        Fetches the related raw object given by ``raw_lookup``.
+
+        """
+        return self.migration.get_raw_object(raw_lookup)
+
     def get_lookup_attributes(self, raw_object, instance):
         """
         Hook to populate an (related) object lookup dictionary.
@@ -124,24 +150,56 @@ class TablespaceRelationBinding(object):
         """
         pass
 
+    def get_identity_key(self, lookup):
+        """
+        Returns the key of the related object given by ``lookup`` in the
+        identity map of the run (or None if it cannot be kept there).
+
+        """
+        if not lookup or self.parent_migration.context.identity_map is None:
+            return None
+        try:
+            key = (self.migration.__class__,self.migration.tablespace,frozenset(lookup.iteritems()))
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
     def handle(self, raw_object, parent):
-        """ """
+        """
+        Returns the related object of ``raw_object``, migrating it unless it
+        exists (or if ``update`` is set). Related objects are resolved once
+        per run and then taken from the identity map of the run.
+
+        """
         raw_lookup = self.get_raw_lookup_attributes(raw_object, parent)
         lookup = self.get_lookup_attributes(raw_object, parent)
+        identity_map = self.parent_migration.context.identity_map
+        identity_key = self.get_identity_key(lookup)
+        if identity_key is not None:
+            related_obj = identity_map.get(identity_key)
+            if related_obj is not None:
+                return related_obj
+
         related_raw_object = raw_object
         if self.fetch:
-            related_raw_object = self.migration.get_raw_object(raw_lookup)
+            related_raw_object = self.get_related_raw_object(raw_lookup)
+        # related objects which are not updated only need their pk
         related_obj = self.migration.get_object( \
-            raw_object, extra_lookup=lookup)
+            raw_object, extra_lookup=lookup, deferred=not self.update)
 
-        print "related_obj=%s" % (related_obj)
+        print "related_obj=%s" % (getattr(related_obj,'pk',None))
         print "raw_lookup=%s" % (raw_lookup)
         print "lookup=%s" % (lookup)
         print "update=%s" % (self.update)
 
-        if related_obj and not self.update:
-            return related_obj
-        return self.migration.migrate_object(related_raw_object,related_obj)
+        # a dry run resolves related objects without migrating them
+        if (not related_obj or self.update) and not self.parent_migration.context.dry_run:
+            related_obj = self.migration.migrate_object(related_raw_object,related_obj)
+        if identity_key is not None and related_obj is not None:
+            self.parent_migration.context.record_change(identity_map,identity_key)
+            identity_map.set(identity_key,related_obj)
+        return related_obj
 
 class ForeignKeyBinding(TablespaceRelationBinding):
     """ 
@@ -152,7 +210,7 @@ class ForeignKeyBinding(TablespaceRelationBinding):
     
     """
     class Meta:
-        key_type = long # key_type is an integer by default
+        key_type = long # key_type is an integer by default (native_key_type for typed columns)
         primary_key = '' # data model primary key attribute name
         local_key = '' # tablespace (local) attribute name
         remote_key = '' # tablespace (remote) attribute name (used to search distinct tablespace, if necessary)
@@ -172,10 +230,59 @@ class ForeignKeyBinding(TablespaceRelationBinding):
         if not self.remote_key:
             remote_reference_key = local_reference_key
 
+    def get_key(self, raw_object):
+        """
+        Returns the value of ``local_key`` in ``raw_object`` as ``key_type``.
+
+        """
+        value = raw_object[self.local_key]
+        if self.key_type is native_key_type:
+            # empty fields are left as-is by the column affinity
+            if value is None or value == '':
+                raise ValueError(u"Empty key value")
+            return value
+        return self.key_type(value)
+
+    def prefetch(self, raw_objects):
+        """
+        Fetches the related raw objects of ``raw_objects`` by ``remote_key``
+        in bulk. Keys without a related raw object are remembered as such.
+
+        """
+        self.prefetched = {}
+        if not self.fetch:
+            return
+
+        keys = set()
+        for raw_object in raw_objects:
+            try:
+                keys.add( self.get_key(raw_object) )
+            except (IndexError,TypeError,ValueError):
+                pass
+        if not keys:
+            return
+
+        prefetched = dict.fromkeys(keys)
+        for related_raw_object in self.migration.get_raw_objects_in(self.remote_key,keys):
+            try:
+                key = self.key_type(related_raw_object[self.remote_key])
+            except (TypeError,ValueError):
+                continue
+            # the first match, as ``get_raw_object`` would have returned
+            if prefetched.get(key) is None:
+                prefetched[key] = related_raw_object
+        self.prefetched = prefetched
+
+    def get_related_raw_object(self, raw_lookup):
+        try:
+            return self.prefetched[raw_lookup[self.remote_key]]
+        except (KeyError,TypeError):
+            return super(ForeignKeyBinding,self).get_related_raw_object(raw_lookup)
+
     def get_lookup_attributes(self, raw_object, instance):
         """ """
         try:
-            return {self.primary_key:self.key_type(raw_object[self.local_key])}
+            return {self.primary_key:self.get_key(raw_object)}
         except (IndexError,TypeError,ValueError):
             logging.warning( \
                 u"Source data %s did not define local_key=%s or key_type=%s could not transform an invalid value" % \
@@ -185,7 +292,7 @@ class ForeignKeyBinding(TablespaceRelationBinding):
     def get_raw_lookup_attributes(self, raw_object, instance):
         """ """
         try:
-            return {self.remote_key:self.key_type(raw_object[self.local_key])}
+            return {self.remote_key:self.get_key(raw_object)}
         except (IndexError,TypeError,ValueError):
             logging.warning( \
                 u"Source data %s did not define local_key=%s or key_type=%s could not transform an invalid value" % \
@@ -1,5 +1,10 @@
+import collections
+import itertools
+import datetime
+import hashlib
 import logging
 import sqlite3
+import time
 import re
 
 
@@ -10,36 +15,325 @@ import re
 #
 # TODO: Cleanup/refactor/&c.
 #
-COLUMN_DEFINITION = u"'%s' TEXT"
+COLUMN_DEFINITION = u"'%s' %s"
+DEFAULT_COLUMN_TYPE = u"TEXT"
 CREATE_TABLE = u"CREATE TABLE IF NOT EXISTS %(table_name)s (%(columns)s)"
 DROP_TABLE = u"DROP TABLE IF EXISTS %(table_name)s"
 CREATE_INDEX = u"CREATE INDEX IF NOT EXISTS %(index_name)s ON %(table_name)s (%(columns)s)"
 INSERT_STMT = u"INSERT INTO %(table_name)s (%(columns)s) VALUES (%(values)s)"
 JOIN_CLAUSE = u"%(join_type)s JOIN %(table_name)s ON (%(lhs_table)s.%(lhs_col)s=%(rhs_table)s.%(rhs_col)s)"
 WHERE_CLAUSE = u"WHERE %(conditions)s"
-SELECT_STMT = u"SELECT * FROM %(table_name)s %(join_clause)s %(where_clause)s"
-SELECT_DISTINCT_STMT = u"SELECT DISTINCT * FROM %(table_name)s %(join_clause)s %(where_clause)s"
+SELECT_STMT = u"SELECT * FROM %(table_name)s %(join_clause)s %(where_clause)s %(limit_clause)s"
+SELECT_DISTINCT_STMT = u"SELECT DISTINCT * FROM %(table_name)s %(join_clause)s %(where_clause)s %(limit_clause)s"
+SELECT_ROWID_STMT = u"SELECT %(table_name)s.rowid AS %(rowid_column)s, * FROM %(table_name)s %(join_clause)s %(where_clause)s ORDER BY %(table_name)s.rowid %(limit_clause)s"
+MAX_ROWID_STMT = u"SELECT MAX(rowid) FROM %(table_name)s"
+LIMIT_CLAUSE = u"LIMIT %(limit)d"
+ANALYZE_STMT = u"ANALYZE %(table_name)s"
+ATTACH_DATABASE = u"ATTACH DATABASE ? AS %(alias)s"
+DETACH_DATABASE = u"DETACH DATABASE %(alias)s"
+COPY_TABLE_STMT = u"INSERT INTO %(table_name)s SELECT * FROM %(alias)s.%(table_name)s"
+TABLE_INFO_STMT = u"PRAGMA table_info(%(table_name)s)"
+INDEX_LIST_STMT = u"PRAGMA index_list(%(table_name)s)"
+INDEX_INFO_STMT = u"PRAGMA index_info(%(index_name)s)"
+EXPLAIN_STMT = u"EXPLAIN QUERY PLAN %(statement)s"
+ADD_COLUMN_STMT = u"ALTER TABLE %(table_name)s ADD COLUMN %(column)s"
+CREATE_UNIQUE_INDEX = u"CREATE UNIQUE INDEX IF NOT EXISTS %(index_name)s ON %(table_name)s (%(columns)s)"
+
+#
+# Incremental (delta) imports
+#
+DELTA_COLUMNS = (
+    (u'_row_hash', u'TEXT'),
+    (u'_imported', u'INTEGER'),
+    (u'_removed', u'INTEGER'),
+    )
+IMPORTS_TABLE = u"_db_transform_imports"
+CREATE_IMPORTS_TABLE = u"CREATE TABLE IF NOT EXISTS %(table_name)s (import_id INTEGER PRIMARY KEY AUTOINCREMENT, tablespace TEXT, imported TEXT, inserted INTEGER, updated INTEGER, removed INTEGER)"
+INSERT_IMPORT_STMT = u"INSERT INTO %(table_name)s (tablespace, imported) VALUES (?, ?)"
+UPDATE_IMPORT_STMT = u"UPDATE %(table_name)s SET inserted=?, updated=?, removed=? WHERE import_id=?"
+SELECT_IMPORT_STMT = u"SELECT MAX(import_id) FROM %(table_name)s WHERE tablespace=?"
+CREATE_SEEN_TABLE = u"CREATE TEMP TABLE %(table_name)s (\"%(key)s\" %(key_type)s UNIQUE)"
+INSERT_SEEN_STMT = u"INSERT OR IGNORE INTO %(table_name)s VALUES (?)"
+DELTA_INSERT_STMT = u"INSERT OR IGNORE INTO %(table_name)s (%(columns)s) VALUES (%(values)s)"
+DELTA_UPDATE_STMT = u"UPDATE %(table_name)s SET %(assignments)s, _row_hash=?, _imported=?, _removed=NULL " + \
+    u"WHERE \"%(key)s\"=? AND (_row_hash IS NOT ? OR _removed IS NOT NULL)"
+DELTA_REMOVE_STMT = u"UPDATE %(table_name)s SET _removed=?, _imported=? WHERE _removed IS NULL AND NOT EXISTS " + \
+    u"(SELECT 1 FROM %(seen_table)s WHERE %(seen_table)s.\"%(key)s\"=%(table_name)s.\"%(key)s\")"
+
+#
+# Migration checkpoints (see ``iter_object_pages``)
+#
+# (a str: rows cannot be indexed by unicode names)
+ROWID_COLUMN = "_rowid"
+CHECKPOINTS_TABLE = u"_db_transform_checkpoints"
+CREATE_CHECKPOINTS_TABLE = u"CREATE TABLE IF NOT EXISTS %(table_name)s (migration TEXT, tablespace TEXT, last_rowid INTEGER, completed INTEGER, updated TEXT, PRIMARY KEY (migration, tablespace))"
+SELECT_CHECKPOINT_STMT = u"SELECT last_rowid, completed FROM %(table_name)s WHERE migration=? AND tablespace=?"
+SAVE_CHECKPOINT_STMT = u"INSERT OR REPLACE INTO %(table_name)s (migration, tablespace, last_rowid, completed, updated) VALUES (?, ?, ?, ?, ?)"
+DELETE_CHECKPOINT_STMT = u"DELETE FROM %(table_name)s WHERE migration=? AND tablespace=?"
+
+# durability is traded for load speed while (re)building a staging database,
+# which can always be recreated from its source files. Without a journal a
+# failed transaction cannot be rolled back, so incremental imports, which
+# carry the import history of a tablespace, must not be loaded this way
+BULK_PRAGMAS = (
+    u"PRAGMA synchronous=OFF",
+    u"PRAGMA journal_mode=OFF",
+    u"PRAGMA temp_store=MEMORY",
+    u"PRAGMA cache_size=-65536",
+    )
+
+# read-optimized ways of opening a staging database for migration runs:
+# 'memory' copies it into an in-memory database, 'mmap' reads it through a
+# large memory map and page cache (connections are read-only in both cases)
+STAGING_MODES = ('file','memory','mmap')
+READ_PRAGMAS = (
+    u"PRAGMA mmap_size=1073741824",
+    u"PRAGMA cache_size=-262144",
+    u"PRAGMA temp_store=MEMORY",
+    u"PRAGMA query_only=ON",
+    )
+SELECT_SCHEMA_STMT = u"SELECT type, name, sql FROM %(alias)s.sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%%'"
+COPY_DATABASE_TABLE_STMT = u"INSERT INTO main.%(table_name)s SELECT * FROM %(alias)s.%(table_name)s"
+
+# number of records handed to ``executemany`` at a time by ``bulk_load_objects``
+DEFAULT_BATCH_SIZE = 1000
+
+# number of rows fetched from SQLite at a time by ``iter_objects``
+DEFAULT_ARRAYSIZE = 500
+
+# highest number of parameters SQLite accepts in a statement (SQLITE_MAX_VARIABLE_NUMBER)
+MAX_VARIABLES = 999
+
+# marks lookups absent from the ``get_object`` cache (``None`` being a valid result)
+CACHE_MISS = object()
 
 
 class MigrationDatabaseError(Exception):
     pass
 
+def get_row_columns(row):
+    """
+    Returns the names of the columns of ``row`` in order if it is a row
+    returned by a ``MigrationDatabase`` (or None).
+
+    """
+    if isinstance(row,sqlite3.Row):
+        return tuple(row.keys())
+    return None
+
+class BoundedCache(object):
+    """
+    A mapping holding at most ``size`` entries, evicting the least recently
+    used one when full. Lookups are counted as hits and misses.
+
+    """
+    def __init__(self, size):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        try:
+            value = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.entries[key] = value
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.entries.pop(key,None)
+        self.entries[key] = value
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self.entries.pop(key,default)
+
+    def clear(self):
+        self.entries.clear()
+
 class MigrationDatabase(object):
     """
     Provides an interface for a transition database: one which with a (partially, at least)
     defined schema and one which is type-less.
 
     """
-    def __init__(self, migration_db_name, writeback=True):
-        self.con = sqlite3.connect( "%s.sqlite3" % migration_db_name )
+    # connections shared by migrations, by migration database name (see ``get_database``)
+    databases = {}
+
+    def __init__(self, migration_db_name, writeback=True, bulk=False, cache_size=0, mode='file'):
+        if mode not in STAGING_MODES:
+            raise MigrationDatabaseError( \
+                u"Unknown staging mode %s (expected one of %s)" % (mode,', '.join(STAGING_MODES)))
+
+        self.migration_db_name = migration_db_name
+        self.mode = mode
+        self.bulk = bulk
+        self.connect()
+        self.tablespace_columns = {}
+
+        # checkpoints are written through a connection of their own (see
+        # ``get_state_connection``)
+        self.state_con = None
+
+        # caches the results of ``get_object`` (if enabled)
+        self.object_cache = None
+        if cache_size:
+            self.object_cache = BoundedCache(cache_size)
+
+    def connect(self):
+        if self.mode == 'memory':
+            self.con = self._copy_to_memory( "%s.sqlite3" % self.migration_db_name )
+        else:
+            self.con = sqlite3.connect( "%s.sqlite3" % self.migration_db_name )
         self.con.row_factory = sqlite3.Row
+        if self.mode != 'file':
+            for pragma_statement in READ_PRAGMAS:
+                self.con.execute( pragma_statement )
+            logging.info("Opened %s in read-only %s mode" % (self.migration_db_name,self.mode))
+
+        if self.bulk:
+            for pragma_statement in BULK_PRAGMAS:
+                self.con.execute( pragma_statement )
+            logging.info("Opened %s in bulk-load mode" % (self.migration_db_name))
+
+    def _copy_to_memory(self, filename):
+        """
+        Returns a connection to an in-memory copy of the database ``filename``.
+
+        """
+        con = sqlite3.connect( ':memory:' )
+        source = sqlite3.connect( filename )
+        try:
+            if hasattr(source,'backup'):
+                source.backup( con )
+                return con
+        finally:
+            source.close()
+
+        # the backup API is unavailable before Python 3.7: copy the schema and
+        # data table by table, building indexes once the data is in place
+        alias = 'copy_source'
+        con.execute( ATTACH_DATABASE % {'alias':alias}, (filename,) )
+        schema = con.execute( SELECT_SCHEMA_STMT % {'alias':alias} ).fetchall()
+        for object_type,name,sql in schema:
+            if object_type == 'table':
+                con.execute( sql )
+                con.execute( COPY_DATABASE_TABLE_STMT % {'table_name':name, 'alias':alias} )
+        con.commit()
+        for object_type,name,sql in schema:
+            if object_type == 'index':
+                con.execute( sql )
+        con.execute( u"ANALYZE" )
+        con.commit()
+        con.execute( DETACH_DATABASE % {'alias':alias} )
+        return con
+
+    @classmethod
+    def get_database(cls, migration_db_name, **options):
+        """
+        Returns the shared instance for ``migration_db_name``, opening it on
+        first use. The ``get_object`` cache is grown to the largest
+        ``cache_size`` requested.
+
+        """
+        try:
+            db = cls.databases[migration_db_name]
+        except KeyError:
+            db = cls.databases[migration_db_name] = cls(migration_db_name,**options)
+            return db
+
+        cache_size = options.get('cache_size',0)
+        if cache_size and db.object_cache is None:
+            db.object_cache = BoundedCache(cache_size)
+        elif cache_size and cache_size > db.object_cache.size:
+            db.object_cache.size = cache_size
+        return db
+
+    @classmethod
+    def close_databases(cls):
+        for db in cls.databases.values():
+            db.con.close()
+            if db.state_con is not None:
+                db.state_con.close()
+        cls.databases.clear()
+
+    @classmethod
+    def reconnect_databases(cls):
+        """
+        Gives a forked process connections of its own to the databases opened
+        by its parent, which must not be shared. In-memory copies are already
+        private to the process and are kept.
+
+        """
+        for db in cls.databases.values():
+            if db.mode != 'memory':
+                db.connect()
+            db.state_con = None
+
+    def get_state_connection(self):
+        """
+        Returns the connection used to record migration checkpoints. It is
+        kept apart from ``con`` so that checkpoints reach the database file
+        whatever the staging mode and so that committing them does not reset
+        the cursors of ``con``.
+
+        """
+        if self.state_con is None:
+            self.state_con = sqlite3.connect( "%s.sqlite3" % self.migration_db_name )
+            self.state_con.execute( CREATE_CHECKPOINTS_TABLE % {'table_name':CHECKPOINTS_TABLE} )
+            self.state_con.commit()
+        return self.state_con
+
+    def get_checkpoint(self, migration, tablespace):
+        """
+        Returns the (last rowid, completed) checkpoint recorded for
+        ``migration`` over ``tablespace``, or None.
+
+        """
+        row = self.get_state_connection().execute( \
+            SELECT_CHECKPOINT_STMT % {'table_name':CHECKPOINTS_TABLE}, (migration,tablespace) ).fetchone()
+        if row is None:
+            return None
+        return (row[0],bool(row[1]))
 
-    def create_tablespace(self, name, fields):
-        columns_definition_statement = u", ".join([ COLUMN_DEFINITION%(field[0]) for field in fields])
+    def save_checkpoint(self, migration, tablespace, last_rowid, completed=False):
+        """
+        Records that ``migration`` has migrated the rows of ``tablespace`` up
+        to (and including) ``last_rowid``.
+
+        """
+        con = self.get_state_connection()
+        con.execute( SAVE_CHECKPOINT_STMT % {'table_name':CHECKPOINTS_TABLE},
+            (migration,tablespace,last_rowid,int(completed),datetime.datetime.now().isoformat()) )
+        con.commit()
+
+    def clear_checkpoint(self, migration, tablespace):
+        con = self.get_state_connection()
+        con.execute( DELETE_CHECKPOINT_STMT % {'table_name':CHECKPOINTS_TABLE}, (migration,tablespace) )
+        con.commit()
+
+    def create_tablespace(self, name, fields, column_types={}):
+        """
+        Creates tablespace ``name`` with a column per field. ``column_types`` maps
+        the source type of a field to the SQLite column affinity to declare;
+        unmapped types are declared as ``DEFAULT_COLUMN_TYPE``.
+
+        """
+        columns_definition_statement = u", ".join([ \
+                COLUMN_DEFINITION % (field[0],column_types.get(field[1],DEFAULT_COLUMN_TYPE))
+                for field in fields])
         create_table_statement = CREATE_TABLE % {'table_name':name, 'columns':columns_definition_statement}
         logging.info("NOTICE: create_table_statement=%s" % (create_table_statement))
         self.con.execute( create_table_statement )
         self.con.commit()
+        self.forget_tablespace(name)
 
         logging.info("Created tablespace %s" % (name))
 
@@ -47,9 +341,126 @@ class MigrationDatabase(object):
         drop_table_statement = DROP_TABLE % {'table_name':name}
         self.con.execute( drop_table_statement )
         self.con.commit()
+        self.forget_tablespace(name)
 
         logging.info("Deleted tablespace %s" % (name))
 
+    def forget_tablespace(self, name):
+        """
+        Forgets the columns and cached objects of tablespace ``name`` once it
+        has been dropped or (re)loaded. The shared instance of the database
+        (see ``get_database``), if another one, would keep serving them: its
+        caches are cleared for whoever holds it and it is dropped from the
+        registry, so that later users open the database afresh.
+
+        """
+        self.tablespace_columns.pop(name,None)
+        self.clear_cache()
+        db = self.databases.get(self.migration_db_name)
+        if db is not None and db is not self:
+            db.tablespace_columns.pop(name,None)
+            db.clear_cache()
+            del self.databases[self.migration_db_name]
+
+    def clear_cache(self):
+        if self.object_cache is not None:
+            self.object_cache.clear()
+
+    def get_cache_stats(self):
+        """
+        Returns the hit and miss counters of the ``get_object`` cache.
+
+        """
+        if self.object_cache is None:
+            return {'size':0, 'hits':0, 'misses':0}
+        return {'size':len(self.object_cache),
+                'hits':self.object_cache.hits,
+                'misses':self.object_cache.misses}
+
+    def get_columns(self, name):
+        """
+        Returns the (name, declared type) pairs of the columns of tablespace
+        ``name``, or an empty list if it does not exist.
+
+        """
+        try:
+            return self.tablespace_columns[name]
+        except KeyError:
+            pass
+        columns = [(row[1],row[2]) for row in self.con.execute(TABLE_INFO_STMT % {'table_name':name})]
+        self.tablespace_columns[name] = columns
+        return columns
+
+    def is_delta_tablespace(self, name):
+        """
+        Whether tablespace ``name`` is maintained by incremental imports.
+
+        """
+        return DELTA_COLUMNS[0][0] in [column[0] for column in self.get_columns(name)]
+
+    def create_delta_tablespace(self, name, fields, key, column_types={}):
+        """
+        Creates (or extends with newly exported fields) tablespace ``name`` for
+        incremental imports keyed by the source field ``key``. Each row carries
+        a hash of its content, the import in which it last changed and the
+        import in which it was removed, if any.
+
+        """
+        columns = [column[0] for column in self.get_columns(name)]
+        if columns and not self.is_delta_tablespace(name):
+            raise MigrationDatabaseError( \
+                u"Tablespace %s was not created by an incremental import; delete it first" % (name))
+        if not columns:
+            self.create_tablespace(name,fields,column_types)
+            columns = [column[0] for column in self.get_columns(name)]
+
+        definitions = [(field[0],column_types.get(field[1],DEFAULT_COLUMN_TYPE)) for field in fields]
+        definitions.extend( DELTA_COLUMNS )
+        for column,column_type in definitions:
+            if column in columns:
+                continue
+            self.con.execute( ADD_COLUMN_STMT % {
+                    'table_name':name, 'column':COLUMN_DEFINITION % (column,column_type)} )
+        self.con.execute( CREATE_UNIQUE_INDEX % {
+                'index_name':"%s__%s__delta" % (name,key), 'table_name':name, 'columns':key} )
+        self.con.execute( CREATE_IMPORTS_TABLE % {'table_name':IMPORTS_TABLE} )
+        self.con.commit()
+        self.forget_tablespace(name)
+
+        logging.info("Created tablespace %s for incremental imports keyed by %s" % (name,key))
+
+    def get_import_id(self, tablespace):
+        """
+        Returns the id of the latest incremental import into ``tablespace`` (or
+        None). Rows changed since then can be selected by passing the id as
+        ``changed_since`` to ``get_objects``.
+
+        """
+        try:
+            return self.con.execute( \
+                SELECT_IMPORT_STMT % {'table_name':IMPORTS_TABLE}, (tablespace,) ).fetchone()[0]
+        except sqlite3.OperationalError:
+            return None
+
+    def merge_tablespace(self, name, fields, source_db_name, column_types={}):
+        """
+        Replaces tablespace ``name`` with the tablespace of the same name held
+        in the migration database ``source_db_name``.
+
+        """
+        self.delete_tablespace(name)
+        self.create_tablespace(name,fields,column_types)
+
+        alias = 'merge_source'
+        self.con.execute( ATTACH_DATABASE % {'alias':alias}, ("%s.sqlite3" % source_db_name,) )
+        try:
+            self.con.execute( COPY_TABLE_STMT % {'table_name':name, 'alias':alias} )
+            self.con.commit()
+        finally:
+            self.con.execute( DETACH_DATABASE % {'alias':alias} )
+
+        logging.info("Merged tablespace %s from %s" % (name,source_db_name))
+
     def create_indexes(self, tablespace, indexes):
         for index in indexes:
             create_index_statement = CREATE_INDEX % {
@@ -63,28 +474,184 @@ class MigrationDatabase(object):
         logging.warn("Loaded indexes %s into tablespace %s" % (indexes,tablespace))
         return indexes
 
-    def load_objects(self, tablespace, fields, data):
-        fields_ = fields
-        fields = [u"'%s'"%field[0] for field in fields_]
-        field_markers = [u":%s"%field[0] for field in fields_]
+    def get_indexed_columns(self, tablespace):
+        """
+        Returns the (lowercased) names of the columns of ``tablespace`` which
+        lead an index, i.e. which can be searched without a full scan.
+
+        """
+        columns = set()
+        for index in self.con.execute( INDEX_LIST_STMT % {'table_name':tablespace} ).fetchall():
+            index_info = self.con.execute( INDEX_INFO_STMT % {'index_name':index[1]} ).fetchall()
+            for column in index_info:
+                if column[0] == 0:
+                    columns.add( column[2].lower() )
+        return columns
+
+    def analyze(self, tablespace):
+        """
+        Gathers the statistics used by the SQLite query planner for ``tablespace``
+        and its indexes.
+
+        """
+        self.con.execute( ANALYZE_STMT % {'table_name':tablespace} )
+        self.con.commit()
 
+        logging.info("Analyzed tablespace %s" % (tablespace))
+
+    def _iter_rows(self, field_names, data):
+        """
+        Yields the records of ``data`` as tuples of values ordered by
+        ``field_names``. Records given as tuples (e.g. by compact backends)
+        are expected to be in field order already and are used as they are.
+
+        """
         for datum in data:
-            insert_statement = INSERT_STMT % {
-                'table_name': tablespace,
-                'columns': ','.join(fields),
-                'values': ','.join(['?' for key,val in datum.iteritems()]),
-                }
-            self.con.execute( insert_statement, tuple([datum[field[0]] for field in fields_]) )
+            if type(datum) == tuple:
+                yield datum
+            else:
+                yield tuple([datum[name] for name in field_names])
+
+    def load_objects(self, tablespace, fields, data):
+        return self.bulk_load_objects(tablespace,fields,data)
+
+    def bulk_load_objects(self, tablespace, fields, data, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Loads ``data`` (any iterable of records, including a generator) into
+        ``tablespace``. The INSERT statement is prepared once and records are
+        pushed through ``executemany`` ``batch_size`` at a time.
+
+        """
+        field_names = [field[0] for field in fields]
+        insert_statement = INSERT_STMT % {
+            'table_name': tablespace,
+            'columns': ','.join([u"'%s'"%name for name in field_names]),
+            'values': ','.join(['?' for name in field_names]),
+            }
+        rows = self._iter_rows(field_names,data)
+        self.forget_tablespace(tablespace)
+
+        cnt = 0
+        started = time.time()
+        while True:
+            batch = list(itertools.islice(rows,batch_size))
+            if not batch:
+                break
+            self.con.executemany( insert_statement, batch )
+            cnt += len(batch)
         self.con.commit()
-        logging.info("Serialized %d records" % (len(data)))
+
+        elapsed = time.time() - started
+        rate = 0.0
+        if elapsed:
+            rate = cnt / elapsed
+        logging.info("Serialized %d records (%.1f records/sec)" % (cnt,rate))
+        return cnt
+
+    def _get_row_hash(self, row):
+        values = [u'' if value is None else unicode(value) for value in row]
+        return hashlib.sha1( u'\x1f'.join(values).encode('utf-8') ).hexdigest()
+
+    def delta_load_objects(self, tablespace, fields, data, key, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Applies ``data`` to a tablespace created by ``create_delta_tablespace``
+        in a single transaction: records with an unknown ``key`` are inserted,
+        records whose content hash differs are updated and previously loaded
+        records missing from ``data`` are marked as removed. Returns the number
+        of records processed; the import is identified by ``get_import_id``.
+
+        """
+        field_names = [field[0] for field in fields]
+        if key not in field_names:
+            raise MigrationDatabaseError( \
+                u"Key %s is not a field of tablespace %s" % (key,tablespace))
+        key_index = field_names.index(key)
+        key_type = dict(self.get_columns(tablespace)).get(key,DEFAULT_COLUMN_TYPE)
+
+        columns = [u'"%s"' % name for name in field_names]
+        columns.extend([ u'"%s"' % column[0] for column in DELTA_COLUMNS ])
+        insert_statement = DELTA_INSERT_STMT % {
+            'table_name':tablespace,
+            'columns':','.join(columns),
+            'values':','.join(['?' for column in columns]),
+            }
+        update_statement = DELTA_UPDATE_STMT % {
+            'table_name':tablespace,
+            'assignments':','.join([u'"%s"=?' % name for name in field_names]),
+            'key':key,
+            }
+        seen_table = u"temp.%s_seen" % (tablespace)
+        remove_statement = DELTA_REMOVE_STMT % {
+            'table_name':tablespace, 'seen_table':seen_table, 'key':key}
+
+        self.con.execute( DROP_TABLE % {'table_name':seen_table} )
+        self.con.execute( CREATE_SEEN_TABLE % {
+                'table_name':seen_table, 'key':key, 'key_type':key_type} )
+
+        rows = self._iter_rows(field_names,data)
+        self.forget_tablespace(tablespace)
+        cnt = inserted = updated = removed = 0
+        started = time.time()
+        try:
+            import_id = self.con.execute( INSERT_IMPORT_STMT % {'table_name':IMPORTS_TABLE},
+                (tablespace,datetime.datetime.now().isoformat()) ).lastrowid
+            while True:
+                batch = list(itertools.islice(rows,batch_size))
+                if not batch:
+                    break
+                cnt += len(batch)
+                batch = [(row,self._get_row_hash(row)) for row in batch]
+                updated += self.con.executemany( update_statement,
+                    [row + (row_hash,import_id,row[key_index],row_hash) for row,row_hash in batch] ).rowcount
+                inserted += self.con.executemany( insert_statement,
+                    [row + (row_hash,import_id,None) for row,row_hash in batch] ).rowcount
+                self.con.executemany( INSERT_SEEN_STMT % {'table_name':seen_table},
+                    [(row[key_index],) for row,row_hash in batch] )
+            removed = self.con.execute( remove_statement, (import_id,import_id) ).rowcount
+            self.con.execute( UPDATE_IMPORT_STMT % {'table_name':IMPORTS_TABLE},
+                (inserted,updated,removed,import_id) )
+            self.con.commit()
+        except:
+            self.con.rollback()
+            raise
+
+        logging.info("Import %d into %s: %d inserted, %d updated, %d removed (%.1f seconds)" % \
+                         (import_id,tablespace,inserted,updated,removed,time.time() - started))
+        return cnt
 
     def _get_select_statement(self, tablespace, params, additional_tablespaces, **options):
         # print "MigrationDatabase.get_object(s): self.tablespace=%s, params=%s, self.additional_tablespaces=%s" % \
         #     (tablespace,params,additional_tablespaces)
         unqiue = options.pop('unique',False)
+        changed_since = options.pop('changed_since',None)
+        include_removed = options.pop('include_removed',False)
+        limit = options.pop('limit',0)
+        rowid_range = options.pop('rowid_range',None)
+        key_in = options.pop('key_in',None)
 
         where_clause = ''
-        conditions = ' AND '.join([ '%s=:%s'%(key,key) for key,val in params.iteritems()])
+        conditions = [ '%s=:%s'%(key,key) for key,val in params.iteritems()]
+        if key_in is not None:
+            key,values = key_in
+            names = ['_in%d' % (i) for i in range(len(values))]
+            conditions.append( '%s.%s IN (%s)' % (tablespace,key,', '.join([':%s' % name for name in names])) )
+            params = dict(params,**dict(zip(names,values)))
+        if rowid_range is not None:
+            conditions.append( '%s.rowid > :_rowid_from' % (tablespace) )
+            params = dict(params,_rowid_from=rowid_range[0])
+            if rowid_range[1] is not None:
+                conditions.append( '%s.rowid <= :_rowid_to' % (tablespace) )
+                params = dict(params,_rowid_to=rowid_range[1])
+        if self.is_delta_tablespace(tablespace):
+            if not include_removed:
+                conditions.append( '%s._removed IS NULL' % (tablespace) )
+            if changed_since is not None:
+                conditions.append( '%s._imported > :_changed_since' % (tablespace) )
+                params = dict(params,_changed_since=changed_since)
+        elif changed_since is not None:
+            raise MigrationDatabaseError( \
+                u"Tablespace %s is not maintained by incremental imports" % (tablespace))
+        conditions = ' AND '.join(conditions)
         if conditions:
             where_clause = WHERE_CLAUSE % {'conditions':conditions}
 
@@ -105,23 +672,61 @@ class MigrationDatabase(object):
                     })
         join_clause = ' '.join(join_clauses)
 
+        limit_clause = ''
+        if limit:
+            limit_clause = LIMIT_CLAUSE % {'limit':limit}
+
         select_params = {                
             'table_name':tablespace,
             'where_clause':where_clause,
-            'join_clause': join_clause
+            'join_clause': join_clause,
+            'limit_clause': limit_clause,
+            'rowid_column': ROWID_COLUMN,
             }
 
-        select_statement = SELECT_STMT % select_params
+        if rowid_range is not None:
+            select_statement = SELECT_ROWID_STMT % select_params
+        else:
+            select_statement = SELECT_STMT % select_params
         return (select_statement,params)
 
+    def explain(self, tablespace, params, additional_tablespaces, **options):
+        """
+        Returns the ``EXPLAIN QUERY PLAN`` details of the select statement
+        ``get_object``/``get_objects`` would run for the given arguments.
+
+        """
+        select_statement,params = \
+            self._get_select_statement(tablespace,params,additional_tablespaces,**options)
+        explain_statement = EXPLAIN_STMT % {'statement':select_statement}
+        return [row[-1] for row in self.con.execute( explain_statement, params )]
+
     def get_object(self, tablespace, lookup, additional_tablespaces, **options):
+        cache_key = None
+        if self.object_cache is not None:
+            try:
+                cache_key = (tablespace,
+                             frozenset(lookup.iteritems()),
+                             frozenset(additional_tablespaces.iteritems()),
+                             frozenset(options.iteritems()))
+                obj = self.object_cache.get(cache_key,CACHE_MISS)
+                if obj is not CACHE_MISS:
+                    return obj
+            except TypeError:
+                # unhashable lookup values are not cached
+                cache_key = None
+
         cursor = self.con.cursor()
         select_statement,lookup = \
             self._get_select_statement(tablespace,lookup,additional_tablespaces,**options)
 
         print "Running: %s (lookup: %s)" % (select_statement,lookup)
         cursor.execute( select_statement, lookup )
-        return cursor.fetchone()
+        obj = cursor.fetchone()
+
+        if cache_key is not None:
+            self.object_cache.set(cache_key,obj)
+        return obj
 
     def get_objects(self, tablespace, conditions, additional_tablespaces, **options):
         cursor = self.con.cursor()
@@ -131,3 +736,89 @@ class MigrationDatabase(object):
         print "Running: %s (conditions: %s)" % (select_statement,conditions)
         cursor.execute( select_statement, conditions )
         return cursor.fetchall()
+
+    def get_objects_in(self, tablespace, key, values, additional_tablespaces, conditions={}, **options):
+        """
+        Returns the rows of ``tablespace`` whose ``key`` is one of ``values``,
+        querying as many values at a time as SQLite allows parameters.
+
+        """
+        values = list(values)
+        chunk_size = MAX_VARIABLES - len(conditions) - 1
+        rows = []
+        for i in range(0,len(values),chunk_size):
+            select_statement, params = \
+                self._get_select_statement(tablespace,conditions,additional_tablespaces,
+                                           key_in=(key,values[i:i + chunk_size]),**options)
+            logging.info("Running: %s (%d values)" % (select_statement,len(values[i:i + chunk_size])))
+            rows.extend( self.con.execute( select_statement, params ).fetchall() )
+        return rows
+
+    def iter_objects(self, tablespace, conditions, additional_tablespaces, arraysize=DEFAULT_ARRAYSIZE, **options):
+        """
+        Like ``get_objects``, but yields rows as they are fetched from SQLite,
+        ``arraysize`` at a time, instead of materializing the whole result.
+
+        """
+        cursor = self.con.cursor()
+        cursor.arraysize = arraysize
+        select_statement, conditions = \
+            self._get_select_statement(tablespace,conditions,additional_tablespaces,**options)
+
+        print "Running: %s (conditions: %s)" % (select_statement,conditions)
+        cursor.execute( select_statement, conditions )
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                break
+            for row in rows:
+                yield row
+
+    def get_max_rowid(self, tablespace):
+        return self.con.execute( MAX_ROWID_STMT % {'table_name':tablespace} ).fetchone()[0] or 0
+
+    def iter_object_pages(self, tablespace, conditions, additional_tablespaces,
+                          after_rowid=0, pagesize=DEFAULT_ARRAYSIZE, **options):
+        """
+        Like ``iter_objects``, but walks ``tablespace`` in order of rowid, a
+        page of (at most) ``pagesize`` rows at a time, starting after
+        ``after_rowid`` (and up to ``to_rowid``, if given). Each page is read
+        after the last rowid of the previous one, so that gaps in the rowids
+        do not produce empty pages, and is yielded as a list of rows carrying
+        their rowid as ``ROWID_COLUMN``. The rows joined to a rowid are never
+        split across pages. No statement is left open between pages.
+
+        """
+        limit = options.pop('limit',0)
+        to_rowid = options.pop('to_rowid',None)
+
+        cnt = 0
+        while True:
+            page_limit = pagesize
+            if limit:
+                page_limit = min(pagesize,limit - cnt)
+            select_statement, params = \
+                self._get_select_statement(tablespace,conditions,additional_tablespaces,
+                                           rowid_range=(after_rowid,to_rowid),limit=page_limit,**options)
+            logging.info("Running: %s (conditions: %s)" % (select_statement,params))
+            rows = self.con.execute( select_statement, params ).fetchall()
+            if not rows:
+                break
+
+            # the rows joined to the last rowid may continue past the page
+            if additional_tablespaces and len(rows) == page_limit:
+                last_rowid = rows[-1][ROWID_COLUMN]
+                complete_rows = [row for row in rows if row[ROWID_COLUMN] != last_rowid]
+                if complete_rows:
+                    rows = complete_rows
+                else:
+                    select_statement, params = \
+                        self._get_select_statement(tablespace,conditions,additional_tablespaces,
+                                                   rowid_range=(last_rowid - 1,last_rowid),**options)
+                    rows = self.con.execute( select_statement, params ).fetchall()
+
+            after_rowid = rows[-1][ROWID_COLUMN]
+            yield rows
+            cnt += len(rows)
+            if limit and cnt >= limit:
+                break